@@ -0,0 +1,228 @@
+"""
+Purpose: Benchmark the link validators offline against a synthetic website.
+
+Starts a local HTTP server that serves a generated site (N pages linking to each
+other, with fragment anchors) and M external destinations with injected faults
+(latency, 429s, 5xx responses and timeouts). Then runs validate-internal-links.py
+and validate-external-links.py against it and reports wall time, the number of
+requests served and peak memory for each.
+
+External destinations are served from `localhost`, while the site is served
+from `127.0.0.1`, so the validators treat them as a separate host.
+
+Use: python3 benchmark-link-validators.py [--pages N] [--external-links M] [--json REPORT_PATH] ...
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+SCRIPT_DIR = Path(__file__).parent
+
+
+def generate_site(args) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    Generate the synthetic site.
+    Returns: ({page path: html}, {external path: fault kind})
+    """
+    rng = random.Random(args.seed)
+
+    external_faults = {}
+    for i in range(args.external_links):
+        roll = rng.random()
+        if roll < args.rate_429:
+            kind = "429"
+        elif roll < args.rate_429 + args.rate_5xx:
+            kind = "5xx"
+        elif roll < args.rate_429 + args.rate_5xx + args.rate_timeout:
+            kind = "timeout"
+        else:
+            kind = "ok"
+        external_faults[f"/ext/{i}"] = kind
+    external_paths = list(external_faults)
+
+    pages = {}
+    for i in range(args.pages):
+        body = [f'<nav><a href="/site">Home</a><a href="/site/page{(i + 1) % args.pages}">Next</a></nav>']
+        body.append("<main>")
+        for a in range(args.anchors_per_page):
+            body.append(f'<h2 id="sec{a}">Section {a}</h2><p>Lorem ipsum dolor sit amet.</p>')
+        for _ in range(args.links_per_page):
+            target = rng.randrange(args.pages)
+            if rng.random() < args.broken_internal_rate:
+                href = f"/site/missing{target}" if rng.random() < 0.5 else f"/site/page{target}#nosuchsection"
+            elif args.anchors_per_page and rng.random() < 0.5:
+                href = f"/site/page{target}#sec{rng.randrange(args.anchors_per_page)}"
+            else:
+                href = f"/site/page{target}"
+            body.append(f'<p><a href="{href}">Internal link</a></p>')
+        for _ in range(min(args.external_per_page, len(external_paths))):
+            body.append(f'<p><a href="http://localhost:{{port}}{rng.choice(external_paths)}">External link</a></p>')
+        body.append("</main>")
+        pages[f"/site/page{i}"] = f"<!DOCTYPE html><html><head><title>Page {i}</title></head><body>{''.join(body)}</body></html>"
+    pages["/site"] = pages["/site/page0"]
+
+    return pages, external_faults
+
+
+def make_handler(pages: dict[str, str], external_faults: dict[str, str], args, counters: Counter, lock: threading.Lock):
+    class Handler(BaseHTTPRequestHandler):
+        # Allow keep-alive connections
+        protocol_version = "HTTP/1.1"
+
+        def respond(self, code: int, body: bytes = b"", headers: dict | None = None):
+            self.send_response(code)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            kind = "external" if path.startswith("/ext/") else "internal"
+            with lock:
+                counters[f"{kind}_requests"] += 1
+                counters[f"{kind} {self.command}"] += 1
+                counters[f"path {path}"] += 1
+                attempt = counters[f"path {path}"]
+
+            if args.latency_ms:
+                time.sleep(args.latency_ms / 1000)
+
+            if kind == "internal":
+                if path in pages:
+                    return self.respond(200, pages[path].replace("{port}", str(self.server.server_port)).encode())
+                return self.respond(404, b"Not found")
+
+            fault = external_faults.get(path)
+            if fault is None:
+                return self.respond(404, b"Not found")
+            if fault == "429" and attempt <= args.throttled_requests:
+                return self.respond(429, b"Slow down", {"Retry-After": str(args.retry_after)})
+            if fault == "5xx":
+                return self.respond(503, b"Unavailable")
+            if fault == "timeout":
+                time.sleep(args.hang_seconds)
+            return self.respond(200, b"OK")
+
+        do_HEAD = do_GET
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def run_validator(name: str, command: list[str]) -> dict:
+    """Run a validator to completion and measure it."""
+    print(f"Running {name}: {shlex.join(command)}")
+    with tempfile.TemporaryFile("w+") as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 reports the resource usage of this child alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        exit_code = os.waitstatus_to_exitcode(status)
+        if exit_code not in (0, 1):
+            stderr.seek(0)
+            print(f"WARNING: {name} exited with code {exit_code}:\n{stderr.read()}", file=sys.stderr)
+    return {
+        "wall_time_seconds": round(wall_time, 3),
+        "exit_code": exit_code,
+        # ru_maxrss is in kibibytes on Linux
+        "peak_memory_kibibytes": rusage.ru_maxrss,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the link validators against a local synthetic site")
+    parser.add_argument("--pages", type=int, default=200, help="Number of pages in the site")
+    parser.add_argument("--links-per-page", type=int, default=20, help="Internal links on each page")
+    parser.add_argument("--anchors-per-page", type=int, default=10, help="Fragment anchors on each page")
+    parser.add_argument("--broken-internal-rate", type=float, default=0.01, help="Fraction of internal links that are broken")
+    parser.add_argument("--external-links", type=int, default=100, help="Number of distinct external destinations")
+    parser.add_argument("--external-per-page", type=int, default=5, help="External links on each page")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Latency added to every response")
+    parser.add_argument("--rate-429", type=float, default=0.05, help="Fraction of external destinations that rate limit")
+    parser.add_argument("--throttled-requests", type=int, default=1, help="Requests answered with 429 before a rate limited destination recovers")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After (seconds) sent with 429 responses")
+    parser.add_argument("--rate-5xx", type=float, default=0.05, help="Fraction of external destinations that return 503")
+    parser.add_argument("--rate-timeout", type=float, default=0, help="Fraction of external destinations that hang")
+    parser.add_argument("--hang-seconds", type=float, default=35, help="How long hanging destinations hang for")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated site")
+    parser.add_argument("--offline", action="store_true", help="Also write the site to disk and pass --out-dir to the validators")
+    parser.add_argument("--validators", choices=["internal", "external", "both"], default="both")
+    parser.add_argument("--internal-args", type=str, default="", help="Extra arguments for validate-internal-links.py")
+    parser.add_argument("--external-args", type=str, default="", help="Extra arguments for validate-external-links.py")
+    parser.add_argument("--json", type=str, help="Write the report to this path")
+    args = parser.parse_args()
+
+    pages, external_faults = generate_site(args)
+    print(f"Generated {len(pages)} pages and {len(external_faults)} external destinations "
+          f"({dict(Counter(external_faults.values()))})")
+
+    counters = Counter()
+    lock = threading.Lock()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(pages, external_faults, args, counters, lock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/site"
+    print(f"Serving synthetic site at {base_url}")
+
+    report = {"config": vars(args), "results": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        extra_args = {"internal": shlex.split(args.internal_args), "external": shlex.split(args.external_args)}
+        if args.offline:
+            out_dir = Path(tmp_dir, "out")
+            for path, html in pages.items():
+                # Lay the site out like a Next.js export
+                file_path = out_dir / ("site/index.html" if path == "/site" else path.lstrip("/") + ".html")
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                file_path.write_text(html.replace("{port}", str(server.server_port)))
+            for kind in extra_args:
+                extra_args[kind] += ["--out-dir", str(out_dir / "site")]
+
+        commands = {
+            "internal": [sys.executable, str(SCRIPT_DIR / "validate-internal-links.py"), base_url],
+            "external": [sys.executable, str(SCRIPT_DIR / "validate-external-links.py"), base_url,
+                         str(Path(tmp_dir, "state.json")), str(Path(tmp_dir, "state.json"))],
+        }
+        for kind, command in commands.items():
+            if args.validators not in (kind, "both"):
+                continue
+            with lock:
+                counters.clear()
+            result = run_validator(kind, command + extra_args[kind])
+            with lock:
+                result["internal_requests"] = counters["internal_requests"]
+                result["external_requests"] = counters["external_requests"]
+                result["requests_by_method"] = {k: v for k, v in counters.items()
+                                                if k.split(" ")[-1] in ("GET", "HEAD")}
+            report["results"][kind] = result
+
+    server.shutdown()
+
+    print()
+    print(f"{'validator':<10} {'wall time (s)':>14} {'internal reqs':>14} {'external reqs':>14} {'peak mem (MiB)':>15} {'exit':>5}")
+    for kind, result in report["results"].items():
+        print(f"{kind:<10} {result['wall_time_seconds']:>14.2f} {result['internal_requests']:>14} "
+              f"{result['external_requests']:>14} {result['peak_memory_kibibytes'] / 1024:>15.1f} {result['exit_code']:>5}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.json}")
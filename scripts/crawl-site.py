@@ -0,0 +1,28 @@
+"""
+Purpose: Crawl a website once and write a link graph artifact (pages, anchors,
+links, XPaths and status codes) that both link validators can read with
+`--crawl-artifact` instead of crawling the site again.
+
+Use: python3 crawl-site.py <BASE_URL> <ARTIFACT_PATH> [--out-dir OUT_DIR] [--crawl-workers N] [--max-depth D] [--parse-workers N]
+"""
+
+import argparse
+
+from crawl_utils import CRAWL_WORKERS, PARSE_WORKERS, crawl_site, save_crawl
+from export_utils import StaticExport
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl a website and write a link graph artifact")
+    parser.add_argument("base_url", type=str, help="URL of the website to crawl")
+    parser.add_argument("artifact_path", type=str, help="Path to write the crawl artifact to")
+    parser.add_argument("--out-dir", type=str, help="Read pages from this static export directory instead of fetching them")
+    parser.add_argument("--crawl-workers", type=int, default=CRAWL_WORKERS, help="Number of pages to fetch in parallel")
+    parser.add_argument("--max-depth", type=int, help="Only crawl pages within this many links of BASE_URL")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="Number of processes parsing HTML (0 parses in the crawl threads)")
+    args = parser.parse_args()
+
+    export = StaticExport(args.out_dir, args.base_url) if args.out_dir else None
+    crawl = crawl_site(args.base_url, export, args.crawl_workers, args.max_depth, args.parse_workers)
+    save_crawl(crawl, args.artifact_path)
+    link_count = sum(len(p["links"]) for p in crawl["pages"].values())
+    print(f"Crawled {len(crawl['pages'])} pages with {link_count} links to {args.artifact_path}")
@@ -0,0 +1,217 @@
+"""
+Shared crawler for the link validators.
+
+A crawl fetches every internal page reachable from the base URL exactly once
+and records, per page, its status code, its anchors (`id` and `name`
+attributes), its links and the positions of the link elements. The result is a
+plain dict that can be saved as a JSON artifact and loaded by both validators,
+so that a site only needs to be crawled once:
+
+    {
+        "version": 3,
+        "base_url": "https://...",
+        "pages": {
+            "<page url>": {
+                "status_code": 200,
+                "error": null,
+                "hash": "<sha256 of the page content>",
+                "anchors": ["<id or name>", ...],
+                "links": [{"url": "<absolute url>", "internal": true, "element": 3}, ...],
+                "elements": [[<parent element>, "<tag>", <sibling index>], ...]
+            }
+        }
+    }
+
+Pages whose content hash matches a record from a previous crawl (`page_cache`)
+are not parsed again.
+
+XPaths are only needed for broken links, so they are computed on demand from
+the element table with get_link_xpath.
+
+Internal links to DEPLOYED_DOMAIN are rewritten to the base URL.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import urldefrag, urljoin
+
+import requests
+
+from export_utils import StaticExport
+from html_utils import extract_links, get_xpath
+from http_utils import get_session
+
+ARTIFACT_VERSION = 3
+DEPLOYED_DOMAIN = "https://cloud.watonomous.ca/"  # Where the build is deployed
+CRAWL_WORKERS = 10 # Number of pages fetched in parallel
+PARSE_WORKERS = os.cpu_count() or 1 # Number of processes parsing HTML
+
+
+def is_internal_url(url: str, base_url: str) -> bool:
+    """Check if a URL is internal to the website."""
+    return url.startswith(base_url.rstrip("/")) or url.startswith(DEPLOYED_DOMAIN.rstrip("/"))
+
+
+def convert_deployed_domain_to_base(url: str, base_url: str) -> str:
+    """Convert a URL from the deployed domain to the base URL."""
+    if url.startswith(DEPLOYED_DOMAIN):
+        return base_url.rstrip("/") + "/" + url[len(DEPLOYED_DOMAIN):]
+    return url
+
+
+def fetch_page(url: str, export: StaticExport | None = None) -> tuple[int, str]:
+    """Fetch a page from the static export if one is given, otherwise over the shared HTTP session."""
+    if export:
+        return export.get(url)
+    response = get_session().get(url)
+    return response.status_code, response.text
+
+
+def crawl_page(url: str, base_url: str, export: StaticExport | None = None,
+               parse_pool: ProcessPoolExecutor | None = None, page_cache: dict | None = None) -> dict:
+    """
+    Fetch a single page and extract its anchors and links. Parsing is CPU bound,
+    so it is handed to `parse_pool` if one is given. If `page_cache` has a record
+    for the page with the same content hash, that record is reused instead.
+    """
+    try:
+        status_code, text = fetch_page(url, export)
+    except requests.RequestException as e:
+        print(f"Request for {url} failed: {e}")
+        return {"status_code": -1, "error": str(e), "hash": None, "anchors": [], "links": [], "elements": []}
+
+    content_hash = hashlib.sha256(text.encode()).hexdigest()
+    cached = (page_cache or {}).get(url)
+    if cached and cached["hash"] == content_hash:
+        return {**cached, "status_code": status_code}
+
+    if parse_pool:
+        return parse_pool.submit(parse_page, url, base_url, status_code, text, content_hash).result()
+    return parse_page(url, base_url, status_code, text, content_hash)
+
+
+def parse_page(url: str, base_url: str, status_code: int, text: str, content_hash: str) -> dict:
+    """Extract the anchors and links of a fetched page into a compact page record."""
+    hrefs, anchors, elements = extract_links(text)
+
+    links = []
+    for href, element in hrefs:
+        link = urljoin(url, href)
+        internal = is_internal_url(link, base_url)
+        links.append({
+            "url": convert_deployed_domain_to_base(link, base_url) if internal else link,
+            "internal": internal,
+            "element": element,
+        })
+
+    return {"status_code": status_code, "error": None, "hash": content_hash,
+            "anchors": sorted(anchors), "links": links, "elements": elements}
+
+
+def get_link_xpath(page: dict, element: int) -> str:
+    """The XPath of a link element on a crawled page."""
+    return get_xpath(page["elements"], element)
+
+
+def crawl_site(base_url: str, export: StaticExport | None = None,
+               max_workers: int = CRAWL_WORKERS, max_depth: int | None = None,
+               parse_workers: int = PARSE_WORKERS, page_cache: dict | None = None) -> dict:
+    """
+    Crawl every internal page reachable from `base_url` (within `max_depth` links,
+    if given), fetching each page once.
+
+    Pages are fetched by a pool of `max_workers` threads from a breadth-first work
+    queue. Only the work in flight is bounded: at most 2 * `max_workers` fetches
+    are queued on the pool at a time. The queue of discovered pages that are not
+    fetched yet is not bounded. Like the set of seen URLs, it can grow with the
+    size of the site.
+    Fetched HTML is parsed by a pool of `parse_workers` processes (or in the
+    fetching threads if `parse_workers` is 0), which only send back the compact
+    page records. Unchanged pages in `page_cache` ({url: page record}) are not parsed.
+    The fetching threads share one keep-alive connection pool of `max_workers`
+    connections (see http_utils).
+
+    Pages are expanded as soon as they are fetched, so a slow page doesn't hold
+    up the pages after it. A page may then first be reached by a longer path.
+    When a shorter one is found, the links of the page are followed again, so
+    every page ends up with its breadth-first depth. The pages are returned in
+    breadth-first order, and the crawl is the same as a serial breadth-first crawl.
+    """
+    depths = {base_url: 0} # Shortest known number of links from base_url
+    queue = deque([base_url]) # Discovered pages that are not submitted yet
+    pages = {}
+    in_flight = {}
+
+    def expand(url):
+        """Queue the unseen links of a fetched page, following them again from pages that got closer."""
+        to_expand = [url]
+        while to_expand:
+            url = to_expand.pop()
+            if max_depth is not None and depths[url] >= max_depth:
+                continue
+            for link in pages[url]["links"]:
+                if not link["internal"]:
+                    continue
+                # Crawl links ignoring fragments
+                dest, _ = urldefrag(link["url"])
+                if dest not in depths:
+                    depths[dest] = depths[url] + 1
+                    queue.append(dest)
+                elif depths[url] + 1 < depths[dest]:
+                    depths[dest] = depths[url] + 1
+                    if dest in pages:
+                        to_expand.append(dest)
+
+    get_session(pool_size=max_workers)
+    if parse_workers > 0:
+        # A fork pool starts all its workers on the first submit. Do that now,
+        # before the fetching threads start: forking a process with running
+        # threads can deadlock the children. Forking (rather than spawning)
+        # also keeps the workers from re-running the calling script.
+        parse_pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context("fork"))
+        parse_pool.submit(os.getpid).result()
+    else:
+        parse_pool = nullcontext()
+    with parse_pool as parse_pool, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while queue or in_flight:
+            while queue and len(in_flight) < 2 * max_workers:
+                url = queue.popleft()
+                in_flight[executor.submit(crawl_page, url, base_url, export, parse_pool, page_cache)] = url
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = in_flight.pop(future)
+                pages[url] = future.result()
+                expand(url)
+
+    # Breadth-first order, as a serial crawl would have discovered the pages
+    order = [base_url]
+    seen = {base_url}
+    for url in order:
+        if max_depth is not None and depths[url] >= max_depth:
+            continue
+        for link in pages[url]["links"]:
+            dest, _ = urldefrag(link["url"])
+            if link["internal"] and dest not in seen:
+                seen.add(dest)
+                order.append(dest)
+
+    return {"version": ARTIFACT_VERSION, "base_url": base_url, "pages": {url: pages[url] for url in order}}
+
+
+def save_crawl(crawl: dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(crawl, f)
+
+
+def load_crawl(path: str) -> dict:
+    with open(path, "r") as f:
+        crawl = json.load(f)
+    if crawl.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported crawl artifact version {crawl.get('version')} in {path}, expected {ARTIFACT_VERSION}")
+    return crawl
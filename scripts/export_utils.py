@@ -0,0 +1,58 @@
+"""
+Utilities for reading the static Next.js export (`output: 'export'`, written to
+`out/` by `npm run build`) from disk, so that the link validators can run
+without an HTTP server.
+"""
+
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+
+class StaticExport:
+    """
+    Maps URLs under `base_url` to files in the export directory `out_dir`.
+
+    Next.js exports pages without trailing slashes, so `docs/foo.html` is served
+    as `/docs/foo`, and `index.html` files are served as their directory. Every
+    file, HTML or not, is also served at its own path.
+    """
+    def __init__(self, out_dir: str, base_url: str):
+        self.out_dir = Path(out_dir)
+        if not self.out_dir.is_dir():
+            raise FileNotFoundError(f"Export directory {self.out_dir} does not exist. Did you run `npm run build`?")
+
+        self.base_path = urlparse(base_url).path.rstrip("/")
+        self.files: dict[str, Path] = {}
+        priorities: dict[str, int] = {}
+        for file_path in sorted(self.out_dir.rglob("*")):
+            if not file_path.is_file():
+                continue
+            url_path = "/" + file_path.relative_to(self.out_dir).as_posix()
+            # Every file is served at its own path. Like a static file server, prefer
+            # that exact file, then `docs.html`, then `docs/index.html` for `/docs`.
+            candidates = [(url_path, 0)]
+            if url_path.endswith("/index.html"):
+                candidates.append((url_path[:-len("/index.html")] or "/", 2))
+            elif url_path.endswith(".html"):
+                candidates.append((url_path[:-len(".html")], 1))
+            for candidate, priority in candidates:
+                if priority < priorities.get(candidate, 3):
+                    self.files[candidate] = file_path
+                    priorities[candidate] = priority
+
+    def url_to_path(self, url: str) -> Path | None:
+        """Return the file that `url` is served from, or None if it is not part of the export."""
+        path = unquote(urlparse(url).path)
+        if not path.startswith(self.base_path):
+            return None
+        path = path[len(self.base_path):].rstrip("/") or "/"
+        return self.files.get(path)
+
+    def get(self, url: str) -> tuple[int, str]:
+        """Return (status code, text) for `url`, as a static file server would."""
+        file_path = self.url_to_path(url)
+        if file_path is None:
+            return 404, ""
+        if file_path.suffix != ".html":
+            return 200, ""
+        return 200, file_path.read_text(errors="replace")
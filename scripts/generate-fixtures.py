@@ -0,0 +1,401 @@
+"""
+Purpose: Generate all website fixtures in a single Python process.
+
+The generator scripts (generate-*.py) are loaded as modules instead of being run
+as separate interpreters, so shared dependencies are imported once and the host
+config is loaded once and passed to every generator that needs it. Independent
+steps run concurrently. Steps that derive files from the fixtures (MDX strings,
+TypeScript types) run once the fixtures exist.
+
+Build cache: every step declares its inputs (files, directories and settings).
+With --cache-dir, the outputs of each step are stored in the cache along with a
+hash of its inputs (`manifest.json`), and a step whose inputs are unchanged is
+skipped and its stored outputs are reused.
+
+Steps write into a staging directory, which only replaces FIXTURES_PATH once
+every step has succeeded, so a failed run never leaves a mix of old and new
+fixtures behind.
+
+With --skip-generate, only the derived files are generated, from fixtures that
+already exist in FIXTURES_PATH (e.g. fixtures fetched from production).
+
+Use: python3 generate-fixtures.py <FIXTURES_PATH> [--data-path DATA_PATH] [--outputs-path OUTPUTS_PATH] [--directory-path DIRECTORY_PATH] [--fact-cache CACHE_PATH] [--cache-dir CACHE_DIR] [--skip-generate]
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent
+DRIVER = Path(__file__) # Defines the output format of every step, so it is an input of each
+PROJECT_DIR = SCRIPT_DIR.parent
+QUICKTYPE = PROJECT_DIR / "node_modules/.bin/quicktype"
+
+MAX_WORKERS = 8 # Number of steps run concurrently
+HASH_WORKERS = 8 # Number of input files hashed in parallel
+MANIFEST_VERSION = 1
+
+# Fixtures that get TypeScript types generated with quicktype
+TYPED_FIXTURES = ["machine-info", "ssh-info", "website-config", "affiliation-info", "user-profiles"]
+
+
+def load_once(load):
+    """Memoize a function without arguments, so that concurrent steps share what it loads."""
+    lock = threading.Lock()
+    result = []
+    def wrapper():
+        with lock:
+            if not result:
+                result.append(load())
+        return result[0]
+    return wrapper
+
+
+def load_script(name):
+    """Load scripts/<name>.py as a module without running its `__main__` block."""
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), SCRIPT_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def log(message):
+    # A single write, so that lines from concurrent steps don't interleave
+    sys.stdout.write(message + "\n")
+
+
+def write_fixture(output_dir, file_name, data):
+    with open(Path(output_dir, file_name), "w") as file:
+        json.dump(data, file, indent=2)
+
+
+def hash_file(path):
+    """The SHA-256 digest of a file, read in chunks."""
+    if not path.exists():
+        return b"<missing>"
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").digest()
+
+
+class InputHasher:
+    """
+    Hashes the inputs of steps. Paths are hashed by content (directories
+    recursively, skipping hidden files), anything else by its string value.
+    Every path is hashed once, however many steps list it, and the files of a
+    directory are hashed in parallel. Inputs must not change while the hasher
+    is in use.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = {} # {path: Future of its digest}
+        self.executor = ThreadPoolExecutor(max_workers=HASH_WORKERS)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def hash_path(self, path):
+        with self.lock:
+            future = self.paths.get(path)
+            first = future is None
+            if first:
+                future = self.paths[path] = Future()
+        if first:
+            try:
+                future.set_result(self._hash_path(path))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def _hash_path(self, path):
+        if not path.is_dir():
+            return hash_file(path)
+        files = sorted(p for p in path.rglob("*") if p.is_file()
+                       and not any(part.startswith(".") for part in p.relative_to(path).parts))
+        digest = hashlib.sha256()
+        for file_path, file_digest in zip(files, self.executor.map(hash_file, files)):
+            digest.update(f"{file_path.relative_to(path)}\0".encode() + file_digest)
+        return digest.digest()
+
+    def hash_inputs(self, inputs):
+        digest = hashlib.sha256()
+        for item in inputs:
+            if isinstance(item, Path):
+                digest.update(f"path:{item.name}\0".encode() + self.hash_path(item))
+            else:
+                digest.update(f"value:{item}\0".encode())
+        return digest.hexdigest()
+
+
+def replace_path(source, target):
+    """
+    Move `source` to `target`, replacing it. Files (and directories that don't
+    exist yet) are replaced atomically. An existing directory is first moved
+    aside, since a non-empty directory can't be renamed over.
+    """
+    target = Path(target)
+    if Path(source).is_dir() and target.exists():
+        old = target.with_name(f".{target.name}.old")
+        shutil.rmtree(old, ignore_errors=True)
+        target.rename(old)
+        os.rename(source, target)
+        shutil.rmtree(old)
+    else:
+        os.replace(source, target)
+
+
+def copy_path(source, target):
+    """Copy a file or directory to `target`, replacing it atomically."""
+    target = Path(target)
+    tmp = target.with_name(f".{target.name}.tmp")
+    if Path(source).is_dir():
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.copytree(source, tmp)
+    else:
+        shutil.copyfile(source, tmp)
+    replace_path(tmp, target)
+
+
+def load_manifest(path):
+    """
+    Load the steps of a build cache manifest: {step name: {"hash", "outputs"}}.
+    A missing or unreadable manifest is empty, and malformed entries are dropped.
+    """
+    try:
+        with open(path, "r") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        log(f"WARNING: could not load build cache manifest {path}: {e}, starting fresh")
+        return {}
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION or not isinstance(manifest.get("steps"), dict):
+        return {}
+    return {name: entry for name, entry in manifest["steps"].items()
+            if isinstance(entry, dict) and isinstance(entry.get("hash"), str) and isinstance(entry.get("outputs"), list)}
+
+
+class StepRunner:
+    """
+    Runs steps into a staging directory, reusing the cached outputs of steps
+    whose inputs haven't changed. Without a `cache_dir`, every step runs.
+    """
+    def __init__(self, staging_dir, cache_dir=None):
+        self.staging_dir = Path(staging_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.lock = threading.Lock()
+        self.manifest = {}
+        if self.cache_dir:
+            self.manifest = load_manifest(self.cache_dir / "manifest.json")
+
+    def run(self, name, step, hasher=None):
+        """
+        Run a step: {"inputs": [...], "outputs": [file or directory names], "run": function(output_dir)}.
+        The outputs are written to a temporary directory, then moved into the
+        cache and copied into the staging directory. Steps run together can
+        share a `hasher`, so their common inputs are only hashed once.
+        """
+        if hasher is None:
+            hasher = InputHasher()
+            try:
+                return self.run(name, step, hasher)
+            finally:
+                hasher.close()
+        input_hash = hasher.hash_inputs(step["inputs"])
+        step_cache_dir = self.cache_dir / "steps" / name if self.cache_dir else None
+        with self.lock:
+            entry = self.manifest.get(name)
+        if (step_cache_dir and entry and entry["hash"] == input_hash
+                and all((step_cache_dir / output).exists() for output in step["outputs"])):
+            log(f"{name}: inputs unchanged, reusing cached outputs")
+            source_dir = step_cache_dir
+        else:
+            log(f"{name}: running")
+            tmp_parent = self.cache_dir or self.staging_dir.parent
+            tmp_parent.mkdir(parents=True, exist_ok=True)
+            output_dir = Path(tempfile.mkdtemp(dir=tmp_parent, prefix=f".{name}."))
+            try:
+                step["run"](output_dir)
+                missing = [o for o in step["outputs"] if not (output_dir / o).exists()]
+                if missing:
+                    raise FileNotFoundError(f"Step {name} did not write {missing}")
+                if not step_cache_dir:
+                    for output in step["outputs"]:
+                        replace_path(output_dir / output, self.staging_dir / output)
+                    return
+                step_cache_dir.parent.mkdir(parents=True, exist_ok=True)
+                replace_path(output_dir, step_cache_dir)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            with self.lock:
+                self.manifest[name] = {"hash": input_hash, "outputs": step["outputs"]}
+            source_dir = step_cache_dir
+
+        for output in step["outputs"]:
+            copy_path(source_dir / output, self.staging_dir / output)
+
+    def run_all(self, steps):
+        """Run independent steps concurrently."""
+        hasher = InputHasher()
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = [executor.submit(self.run, name, step, hasher) for name, step in steps.items()]
+                # Raise the first error, if any
+                for future in futures:
+                    future.result()
+        finally:
+            hasher.close()
+
+    def save_manifest(self):
+        if not self.cache_dir:
+            return
+        tmp = self.cache_dir / ".manifest.json.tmp"
+        with open(tmp, "w") as file:
+            json.dump({"version": MANIFEST_VERSION, "steps": self.manifest}, file, indent=2)
+        os.replace(tmp, self.cache_dir / "manifest.json")
+
+
+def get_generate_steps(args):
+    """The steps that generate the fixtures from the data branch, outputs and directory."""
+    def script(name):
+        return SCRIPT_DIR / f"{name}.py"
+
+    @load_once
+    def get_host_config():
+        from directory.scripts.host_utils import get_host_config
+        return get_host_config()
+
+    def generate_machine_info(output_dir):
+        machine_info = load_script("generate-machine-info")
+        fact_cache = machine_info.FactCache(args.fact_cache)
+        write_fixture(output_dir, "machine-info.json",
+                      machine_info.generate_fixtures(args.data_path, cache=fact_cache, host_config=get_host_config()))
+        fact_cache.save()
+
+    directory_path = Path(args.directory_path)
+    outputs_path = Path(args.outputs_path)
+    return {
+        "machine-info": {
+            "inputs": [Path(args.data_path, "general"), directory_path, script("generate-machine-info"), DRIVER],
+            "outputs": ["machine-info.json"],
+            "run": generate_machine_info,
+        },
+        "ssh-info": {
+            "inputs": [directory_path, script("generate-ssh-info"), DRIVER],
+            "outputs": ["ssh-info.json"],
+            "run": lambda output_dir: write_fixture(output_dir, "ssh-info.json",
+                                                    load_script("generate-ssh-info").generate_ssh_info(get_host_config())),
+        },
+        "website-config": {
+            "inputs": [outputs_path / "discord/outputs.yaml", outputs_path / "sentry/outputs.yaml",
+                       script("generate-website-config"), os.getenv("WEBSITE_BASE_PATH", ""), DRIVER],
+            "outputs": ["website-config.json"],
+            "run": lambda output_dir: write_fixture(output_dir, "website-config.json",
+                                                    load_script("generate-website-config").generate_fixtures(outputs_path)),
+        },
+        "affiliation-info": {
+            "inputs": [directory_path, script("generate-affiliation-info"), DRIVER],
+            "outputs": ["affiliation-info.json"],
+            "run": lambda output_dir: write_fixture(output_dir, "affiliation-info.json", {
+                "affiliations": load_script("generate-affiliation-info").generate_affiliations(),
+            }),
+        },
+        "user-profiles": {
+            "inputs": [directory_path, script("generate-user-profiles"), DRIVER],
+            "outputs": ["user-profiles.json"],
+            "run": lambda output_dir: write_fixture(output_dir, "user-profiles.json",
+                                                    load_script("generate-user-profiles").generate_user_profiles()),
+        },
+        "affiliation-schema": {
+            "inputs": [directory_path / "affiliations/affiliation.schema.json", DRIVER],
+            "outputs": ["affiliation.schema.json"],
+            "run": lambda output_dir: shutil.copy(directory_path / "affiliations/affiliation.schema.json", output_dir),
+        },
+        "user-schema": {
+            "inputs": [outputs_path / "directory/users/user.schema.generated.json", DRIVER],
+            "outputs": ["user.schema.generated.json"],
+            "run": lambda output_dir: shutil.copy(outputs_path / "directory/users/user.schema.generated.json", output_dir),
+        },
+    }
+
+
+def get_derived_steps(fixtures_dir):
+    """The steps that derive files from the fixtures in `fixtures_dir`."""
+    def json_to_mdx(json_file_name, output_name):
+        def run(output_dir):
+            load_script("generate-mdx-strings").json_to_mdx([str(fixtures_dir / json_file_name)],
+                                                            str(Path(output_dir, output_name)))
+        return {
+            "inputs": [fixtures_dir / json_file_name, SCRIPT_DIR / "generate-mdx-strings.py", DRIVER],
+            "outputs": [output_name],
+            "run": run,
+        }
+
+    def quicktype(name):
+        def run(output_dir):
+            subprocess.run([str(QUICKTYPE), "-o", str(Path(output_dir, f"{name}.ts")), str(fixtures_dir / f"{name}.json")],
+                           check=True)
+        return {
+            "inputs": [fixtures_dir / f"{name}.json", PROJECT_DIR / "package-lock.json", DRIVER],
+            "outputs": [f"{name}.ts"],
+            "run": run,
+        }
+
+    steps = {
+        "ssh-info-strings": json_to_mdx("ssh-info.json", "ssh-info-strings"),
+        "user-schema-strings": json_to_mdx("user.schema.generated.json", "user-schema-strings"),
+    }
+    for name in TYPED_FIXTURES:
+        steps[f"{name}-types"] = quicktype(name)
+    return steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate all website fixtures in one process")
+    parser.add_argument("fixtures_path", type=str, help="Path to write the fixtures to")
+    parser.add_argument("--data-path", type=str, default=str(PROJECT_DIR / "build/data"), help="Path to the data branch checkout")
+    parser.add_argument("--outputs-path", type=str, default=str(PROJECT_DIR.parent / "outputs"), help="Path to the infrastructure outputs")
+    parser.add_argument("--directory-path", type=str, default=str(PROJECT_DIR.parent / "directory"),
+                        help="Path to the directory checkout, which the generators import as the `directory` package")
+    parser.add_argument("--fact-cache", type=str, help="Path of the parsed host fact cache of generate-machine-info.py")
+    parser.add_argument("--cache-dir", type=str, help="Reuse the outputs of steps whose inputs are unchanged, cached in this directory")
+    parser.add_argument("--skip-generate", action="store_true", help="Only generate the files derived from existing fixtures")
+    args = parser.parse_args()
+
+    directory_path = Path(args.directory_path).resolve()
+    if directory_path.name != "directory":
+        parser.error(f"--directory-path must be a directory named `directory`, got {directory_path}")
+    # Ahead of the paths the generators add, so they import the same checkout that is hashed
+    sys.path.insert(0, str(directory_path.parent))
+
+    fixtures_path = Path(args.fixtures_path)
+    fixtures_path.parent.mkdir(parents=True, exist_ok=True)
+    staging_dir = fixtures_path.with_name(f".{fixtures_path.name}.staging")
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    if fixtures_path.exists():
+        # Keep existing fixtures (e.g. fetched ones) that no step generates
+        shutil.copytree(fixtures_path, staging_dir)
+    else:
+        staging_dir.mkdir()
+
+    runner = StepRunner(staging_dir, args.cache_dir)
+    try:
+        if not args.skip_generate:
+            runner.run_all(get_generate_steps(args))
+        runner.run_all(get_derived_steps(staging_dir))
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    finally:
+        runner.save_manifest()
+
+    replace_path(staging_dir, fixtures_path)
+    print(f"Wrote fixtures to {fixtures_path}")
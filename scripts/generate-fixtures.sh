@@ -64,32 +64,23 @@ if [ -n "$__fetch_from" ]; then
     wget --no-verbose -O "$PROJECT_DIR/build/fixtures/user.schema.generated.json" "$__fetch_from/user.schema.generated.json"
     wget --no-verbose -O "$PROJECT_DIR/build/fixtures/affiliation-info.json" "$__fetch_from/affiliation-info.json"
     wget --no-verbose -O "$PROJECT_DIR/build/fixtures/user-profiles.json" "$__fetch_from/user-profiles.json"
+    echo "Generating files derived from fixtures..."
+    python3 "$SCRIPT_DIR/generate-fixtures.py" "$PROJECT_DIR/build/fixtures" --skip-generate \
+        --cache-dir "$PROJECT_DIR/build/cache/fixtures"
 else
     echo "Generating fixtures..."
     # Create a new worktree
     git worktree add "$PROJECT_DIR/build/data" origin/data
-    # Generate fixtures
-    python3 "$SCRIPT_DIR/generate-machine-info.py" "$PROJECT_DIR/build/data" "$PROJECT_DIR/build/fixtures"
-    python3 "$SCRIPT_DIR/generate-ssh-info.py" "$PROJECT_DIR/build/fixtures"
-    python3 "$SCRIPT_DIR/generate-website-config.py" "$PROJECT_DIR/../outputs" "$PROJECT_DIR/build/fixtures"
-    cp "$PROJECT_DIR/../directory/affiliations/affiliation.schema.json" "$PROJECT_DIR/build/fixtures"
-    cp "$PROJECT_DIR/../outputs/directory/users/user.schema.generated.json" "$PROJECT_DIR/build/fixtures"
-    python3 "$SCRIPT_DIR/generate-affiliation-info.py" "$PROJECT_DIR/build/fixtures"
-    python3 "$SCRIPT_DIR/generate-user-profiles.py" > "$PROJECT_DIR/build/fixtures/user-profiles.json"
+    # Generate fixtures (and the files derived from them) in one process.
+    # Steps whose inputs are unchanged since the last build are skipped.
+    python3 "$SCRIPT_DIR/generate-fixtures.py" "$PROJECT_DIR/build/fixtures" \
+        --data-path "$PROJECT_DIR/build/data" \
+        --outputs-path "$PROJECT_DIR/../outputs" \
+        --directory-path "$PROJECT_DIR/../directory" \
+        --fact-cache "$PROJECT_DIR/build/cache/machine-info-facts.json" \
+        --cache-dir "$PROJECT_DIR/build/cache/fixtures"
 fi
 
-# Add typescript types
-echo "Generating fixture types..."
-./node_modules/.bin/quicktype -o "$PROJECT_DIR"/build/fixtures/machine-info.{ts,json}
-./node_modules/.bin/quicktype -o "$PROJECT_DIR"/build/fixtures/ssh-info.{ts,json}
-./node_modules/.bin/quicktype -o "$PROJECT_DIR"/build/fixtures/website-config.{ts,json}
-./node_modules/.bin/quicktype -o "$PROJECT_DIR"/build/fixtures/affiliation-info.{ts,json}
-./node_modules/.bin/quicktype -o "$PROJECT_DIR"/build/fixtures/user-profiles.{ts,json}
-
-echo "Generating mdx files from data..."
-python3 "$SCRIPT_DIR/generate-mdx-strings.py" json-to-mdx "$PROJECT_DIR/build/fixtures/ssh-info.json" "$PROJECT_DIR/build/fixtures/ssh-info-strings"
-python3 "$SCRIPT_DIR/generate-mdx-strings.py" json-to-mdx "$PROJECT_DIR/build/fixtures/user.schema.generated.json" "$PROJECT_DIR/build/fixtures/user-schema-strings"
-
 echo "Compiling JSON schema validators..."
 node "$PROJECT_DIR/scripts/compile-json-schema-validators.js" "$PROJECT_DIR/build/fixtures"
 
@@ -1,7 +1,13 @@
 import argparse
 import csv
+import hashlib
 import json
+import mmap
+import os
+import re
+import threading
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 
@@ -9,6 +15,11 @@ sys.path.append(str(Path(__file__).parent.parent.parent))
 
 from directory.scripts.host_utils import get_host_config, get_group_config
 
+MAX_WORKERS = 16 # Number of hosts whose facts are read in parallel
+FACT_CACHE_VERSION = 3 # Bump when the cache format changes (parser changes are picked up by SCRIPT_HASH)
+LSHW_FIELDS = ["vendor"] # Top-level lshw fields that are read (the hardware tree is skipped)
+SCRIPT_HASH = hashlib.sha256(Path(__file__).read_bytes()).hexdigest() # Cached facts are invalid once the parsers change
+
 def parse_colon_separated_file(s: str):
     lines = s.split("\n")
 
@@ -121,113 +132,347 @@ def get_mounts_with_quotas(host):
             })
     return mounts_with_quotas
 
-def get_lshw_info(data_path, host_name):
+_JSON_WHITESPACE = re.compile(rb"\s*")
+_JSON_STRING_REST = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL) # Everything after the opening quote
+# Text up to the next bracket outside of strings
+_JSON_UNTIL_BRACKET = re.compile(rb'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+_JSON_SCALAR_END = re.compile(rb"[\s,}\]]")
+
+def skip_json_value(buf, pos):
+    """Return the position just after the JSON value that starts at `pos`, without parsing it."""
+    first = buf[pos:pos + 1]
+    if first == b'"':
+        return _JSON_STRING_REST.match(buf, pos + 1).end()
+    if first in (b"{", b"["):
+        depth = 0
+        while True:
+            pos = _JSON_UNTIL_BRACKET.match(buf, pos).end()
+            bracket = buf[pos:pos + 1]
+            if bracket not in (b"{", b"[", b"}", b"]"):
+                raise ValueError(f"Unterminated JSON value at position {pos}")
+            pos += 1
+            depth += 1 if bracket in (b"{", b"[") else -1
+            if depth == 0:
+                return pos
+    match = _JSON_SCALAR_END.search(buf, pos)
+    return match.start() if match else len(buf)
+
+def read_top_level_fields(path, fields):
+    """
+    Read only `fields` from the top-level object of a JSON file (or from the
+    first object, if the file holds a list). Other values are skipped without
+    being parsed, and reading stops as soon as all fields are found, so time and
+    memory don't depend on the size of the rest of the document.
+    """
+    def skip_whitespace(pos):
+        return _JSON_WHITESPACE.match(buf, pos).end()
+
+    def expect(pos, token):
+        if buf[pos:pos + 1] != token:
+            raise ValueError(f"Expected {token.decode()} at position {pos} of {path}")
+        return skip_whitespace(pos + 1)
+
+    result = {}
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        pos = skip_whitespace(0)
+        if buf[pos:pos + 1] == b"[":
+            pos = skip_whitespace(pos + 1)
+        pos = expect(pos, b"{")
+        while buf[pos:pos + 1] != b"}" and len(result) < len(fields):
+            key_end = skip_json_value(buf, pos)
+            key = json.loads(buf[pos:key_end])
+            pos = expect(skip_whitespace(key_end), b":")
+            value_end = skip_json_value(buf, pos)
+            if key in fields:
+                result[key] = json.loads(buf[pos:value_end])
+            pos = skip_whitespace(value_end)
+            if buf[pos:pos + 1] == b",":
+                pos = skip_whitespace(pos + 1)
+    return result
+
+def get_lshw_info(data_path, host_name, fields=LSHW_FIELDS):
+    """
+    The top-level `fields` of the lshw info. lshw.json holds the whole hardware
+    tree, but only a few top-level fields are used, so the rest is not parsed.
+    """
     lshw_json_path = Path(data_path, "general", host_name, "lshw.json")
-    if not lshw_json_path.exists():
+    if not lshw_json_path.exists() or lshw_json_path.stat().st_size == 0:
         return {}
-    
-    with open(lshw_json_path, 'r') as file:
-        lshw_info = json.load(file)
 
-    # if is list
-    if isinstance(lshw_info, list):
-        assert len(lshw_info) == 1, f"Expected 1 lshw info, got {len(lshw_info)}. File: {lshw_json_path}"
-        lshw_info = lshw_info[0]
+    return read_top_level_fields(lshw_json_path, fields)
+
+# Facts that are stored in the fact cache, and the files they are parsed from
+CACHED_FACTS = {
+    "cpu_info": (get_cpu_info, ["lscpu.log"]),
+    "memory_info": (get_memory_info, ["meminfo-total.log"]),
+    "gpus": (get_gpu_info, ["nvidia-smi.csv"]),
+    "lshw_info": (get_lshw_info, ["lshw.json"]),
+    "hosted_storage": (get_hosted_storage, ["df-total.log", "exportfs.log"]),
+}
+
+class FactCache:
+    """
+    On-disk cache of parsed host facts. Entries are keyed by a hash of the
+    contents of a host's input files (see CACHED_FACTS), so only the hosts whose
+    data changed are parsed again. Facts are parsed lazily, so a host only
+    caches the facts that its role uses. Without a `path`, nothing is cached.
+
+    The whole cache is dropped when this script changes, since the parsers are
+    part of it. A missing or unreadable cache file is treated as an empty cache.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.checked = set() # Hosts whose input hash was checked in this run
+        self.hits = 0
+        self.misses = 0
+        if path is None:
+            return
+        try:
+            with open(path, "r") as file:
+                cache = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"WARNING: could not load fact cache {path}: {e}, starting fresh")
+            return
+        if not isinstance(cache, dict) or cache.get("version") != FACT_CACHE_VERSION or cache.get("script") != SCRIPT_HASH:
+            return
+        hosts = cache.get("hosts")
+        if isinstance(hosts, dict) and all(isinstance(e, dict) and isinstance(e.get("hash"), str)
+                                           and isinstance(e.get("facts"), dict) for e in hosts.values()):
+            self.hosts = hosts
+        else:
+            print(f"WARNING: fact cache {path} is malformed, starting fresh")
+
+    def get_input_hash(self, data_path, host_name):
+        digest = hashlib.sha256()
+        for file_name in sorted({f for _, files in CACHED_FACTS.values() for f in files}):
+            file_path = Path(data_path, "general", host_name, file_name)
+            digest.update(file_name.encode() + b"\0")
+            if file_path.exists():
+                # Streamed, so large lshw dumps are not read into memory
+                with open(file_path, "rb") as file:
+                    digest.update(hashlib.file_digest(file, "sha256").digest())
+            else:
+                digest.update(b"<missing>")
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, data_path, host_name, fact):
+        parse = CACHED_FACTS[fact][0]
+        if self.path is None:
+            return parse(data_path, host_name)
+
+        with self.lock:
+            entry = self.hosts.get(host_name)
+            checked = host_name in self.checked
+        if not checked:
+            # Hash the inputs once per run
+            input_hash = self.get_input_hash(data_path, host_name)
+            if entry is None or entry["hash"] != input_hash:
+                entry = {"hash": input_hash, "facts": {}}
+            with self.lock:
+                self.hosts[host_name] = entry
+                self.checked.add(host_name)
+
+        if fact in entry["facts"]:
+            with self.lock:
+                self.hits += 1
+            return entry["facts"][fact]
+
+        value = parse(data_path, host_name)
+        with self.lock:
+            self.misses += 1
+            entry["facts"][fact] = value
+        return value
+
+    def save(self):
+        if self.path is None:
+            return
+        print(f"Fact cache: {self.hits} hits, {self.misses} misses")
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # Drop hosts that no longer exist
+        hosts = {name: self.hosts[name] for name in sorted(self.checked)}
+        # An interrupted build leaves the previous cache in place
+        tmp = Path(f"{self.path}.tmp")
+        with open(tmp, "w") as file:
+            json.dump({"version": FACT_CACHE_VERSION, "script": SCRIPT_HASH, "hosts": hosts}, file)
+        os.replace(tmp, self.path)
+
+class fact:
+    """
+    A lazily computed HostFacts property. The value is computed on first access
+    and stored in the slot of the same name with a leading underscore.
+    """
+    def __init__(self, compute):
+        self.compute = compute
+        self.__doc__ = compute.__doc__
+
+    def __set_name__(self, owner, name):
+        self.slot = "_" + name
+
+    def __get__(self, facts, owner=None):
+        if facts is None:
+            return self
+        try:
+            return getattr(facts, self.slot)
+        except AttributeError:
+            value = self.compute(facts)
+            setattr(facts, self.slot, value)
+            return value
+
+class HostFacts:
+    """
+    The facts of a single host, from the host config and the data branch. Each
+    fact is read and parsed at most once, and only if it is used.
+    """
+    __slots__ = (
+        "data_path", "host", "cache", "_group_names", "_node_tags", "_category", "_tags", "_cpu_info",
+        "_memory_info", "_gpus", "_hostnames", "_lsb_release_info", "_ssh_host_keys", "_ssh_host_keys_bastion",
+        "_mounts_with_quotas", "_hosted_storage", "_login_nodes_config",
+    )
+
+    def __init__(self, data_path, host, cache):
+        self.data_path = data_path
+        self.host = host
+        self.cache = cache
 
-    return lshw_info
+    @property
+    def name(self):
+        return self.host["name"]
 
-def generate_fixtures(data_path):
-    host_config = get_host_config()
+    @fact
+    def group_names(self):
+        return [g["name"] for g in self.host["groups"]]
 
-    legacy_general_use_machines = []
-    slurm_compute_nodes = []
-    slurm_login_nodes = []
-    bare_metals = []
-    bastions = []
+    @fact
+    def node_tags(self):
+        return (get_group_config(self.host, "tagged_nodes") or {}).get("tags", [])
 
-    for host in host_config["hosts"]:
-        name = host["name"]
-        group_names = [g["name"] for g in host["groups"]]
+    @fact
+    def category(self):
+        """The machine category the host is listed under, or None if it is not listed on the website."""
+        # TODO: Remove this when we delete all legacy general-use machines
+        if "legacy_general_use_machine" in self.node_tags:
+            assert "login_nodes" in self.group_names, f"{self.name} is a legacy general use machine but is not in a login node group"
+            return "legacy_general_use_machines"
+        if "slurmd_nodes" in self.group_names:
+            slurm_role = get_group_config(self.host, "slurmd_nodes")["slurm_role"]
+            if slurm_role == "compute":
+                return "slurm_compute_nodes"
+            if slurm_role == "login":
+                assert "login_nodes" in self.group_names, f"{self.name} is a SLURM login node but is not in a login node group"
+                return "slurm_login_nodes"
+            return None
+        if "bare_metal_nodes" in self.group_names:
+            return "bare_metals"
+        if "bastion_nodes" in self.group_names:
+            return "bastions"
+        return None
+
+    @fact
+    def tags(self):
         tags = []
-        lshw_info = get_lshw_info(data_path, name)
-        if lshw_info.get("vendor") == "QEMU":
+        if self.cache.get(self.data_path, self.name, "lshw_info").get("vendor") == "QEMU":
             tags.append({
                 "name": "VM",
-                "description": f"{name} is a virtual machine",
+                "description": f"{self.name} is a virtual machine",
             })
+        return tags
 
-        node_tags = (get_group_config(host, "tagged_nodes") or {}).get("tags", [])
+    @fact
+    def cpu_info(self):
+        return self.cache.get(self.data_path, self.name, "cpu_info")
 
-        properties = {
-            "name": name,
-            "tags": tags,
-        }
+    @fact
+    def memory_info(self):
+        return self.cache.get(self.data_path, self.name, "memory_info")
 
-        # TODO: Remove this when we delete all legacy general-use machines
-        if "legacy_general_use_machine" in node_tags:
-            assert "login_nodes" in group_names, f"{name} is a legacy general use machine but is not in a login node group"
-            login_nodes_config = get_group_config(host, "login_nodes")
-            properties.update({
-                "cpu_info": get_cpu_info(data_path, name),
-                "memory_info": get_memory_info(data_path, name),
-                "gpus": get_gpu_info(data_path, name),
-                "hostnames": [r["name"] for n in host["networks"] for r in n.get("dns_records",[])],
-                "lsb_release_info": get_lsb_release_info(data_path, name),
-                "ssh_host_keys": get_file_lines(data_path, name, "ssh-host-keys.log"),
-                "mounts_with_quotas": get_mounts_with_quotas(host),
-                "cpu_quota": login_nodes_config.get("cpu_quota"),
-                "memory_quota": login_nodes_config.get("memory_max"),
-            })
-            legacy_general_use_machines.append(properties)
-        elif "slurmd_nodes" in group_names:
-            slurmd_config = get_group_config(host, "slurmd_nodes")
-            if slurmd_config["slurm_role"] == "compute":
-                properties.update({
-                    "cpu_info": get_cpu_info(data_path, name),
-                    "memory_info": get_memory_info(data_path, name),
-                    "gpus": get_gpu_info(data_path, name),
-                    "hostnames": [r["name"] for n in host["networks"] for r in n.get("dns_records",[])],
-                    "lsb_release_info": get_lsb_release_info(data_path, name),
-                })
-                slurm_compute_nodes.append(properties)
-            elif slurmd_config["slurm_role"] == "login":
-                assert "login_nodes" in group_names, f"{name} is a SLURM login node but is not in a login node group"
-                login_nodes_config = get_group_config(host, "login_nodes")
-                properties.update({
-                    "cpu_info": get_cpu_info(data_path, name),
-                    "memory_info": get_memory_info(data_path, name),
-                    "gpus": get_gpu_info(data_path, name),
-                    "hostnames": [r["name"] for n in host["networks"] for r in n.get("dns_records",[])],
-                    "lsb_release_info": get_lsb_release_info(data_path, name),
-                    "ssh_host_keys": get_file_lines(data_path, name, "ssh-host-keys.log"),
-                    "mounts_with_quotas": get_mounts_with_quotas(host),
-                    "cpu_quota": login_nodes_config.get("cpu_quota"),
-                    "memory_quota": login_nodes_config.get("memory_max"),
-                })
-                slurm_login_nodes.append(properties)
-        elif "bare_metal_nodes" in group_names:
-            properties.update({
-                "cpu_info": get_cpu_info(data_path, name),
-                "memory_info": get_memory_info(data_path, name),
-                "hosted_storage": get_hosted_storage(data_path, name),
-            })
-            bare_metals.append(properties)
-        elif "bastion_nodes" in group_names:
-            properties.update({
-                "cpu_info": get_cpu_info(data_path, name),
-                "memory_info": get_memory_info(data_path, name),
-                "hostnames": [r["name"] for n in host["networks"] for r in n.get("dns_records",[])],
-                "ssh_host_keys_bastion": get_file_lines(data_path, name, "ssh-host-keys-bastion.log"),
-            })
-            bastions.append(properties)
+    @fact
+    def gpus(self):
+        return self.cache.get(self.data_path, self.name, "gpus")
+
+    @fact
+    def hosted_storage(self):
+        return self.cache.get(self.data_path, self.name, "hosted_storage")
+
+    @fact
+    def hostnames(self):
+        return [r["name"] for n in self.host["networks"] for r in n.get("dns_records",[])]
+
+    @fact
+    def lsb_release_info(self):
+        return get_lsb_release_info(self.data_path, self.name)
+
+    @fact
+    def ssh_host_keys(self):
+        return get_file_lines(self.data_path, self.name, "ssh-host-keys.log")
+
+    @fact
+    def ssh_host_keys_bastion(self):
+        return get_file_lines(self.data_path, self.name, "ssh-host-keys-bastion.log")
+
+    @fact
+    def mounts_with_quotas(self):
+        return get_mounts_with_quotas(self.host)
+
+    @fact
+    def login_nodes_config(self):
+        return get_group_config(self.host, "login_nodes")
+
+    @property
+    def cpu_quota(self):
+        return self.login_nodes_config.get("cpu_quota")
+
+    @property
+    def memory_quota(self):
+        return self.login_nodes_config.get("memory_max")
+
+# The properties listed for each machine category, in output order, after `name` and `tags`
+CATEGORY_FIELDS = {
+    "legacy_general_use_machines": ["cpu_info", "memory_info", "gpus", "hostnames", "lsb_release_info",
+                                    "ssh_host_keys", "mounts_with_quotas", "cpu_quota", "memory_quota"],
+    "slurm_compute_nodes": ["cpu_info", "memory_info", "gpus", "hostnames", "lsb_release_info"],
+    "slurm_login_nodes": ["cpu_info", "memory_info", "gpus", "hostnames", "lsb_release_info",
+                          "ssh_host_keys", "mounts_with_quotas", "cpu_quota", "memory_quota"],
+    "bare_metals": ["cpu_info", "memory_info", "hosted_storage"],
+    "bastions": ["cpu_info", "memory_info", "hostnames", "ssh_host_keys_bastion"],
+}
+
+def get_host_properties(data_path, host, cache):
+    """
+    Read the facts of a single host that its machine category lists (see CATEGORY_FIELDS).
+    Returns: (machine category, properties), or None if the host is not listed on the website
+    """
+    facts = HostFacts(data_path, host, cache)
+    if facts.category is None:
+        return None
+    return facts.category, {field: getattr(facts, field) for field in ["name", "tags", *CATEGORY_FIELDS[facts.category]]}
+
+def generate_fixtures(data_path, max_workers=MAX_WORKERS, cache=None, host_config=None):
+    """
+    Generate the machine info fixture. Host facts are read on a pool of
+    `max_workers` threads, since reading them is dominated by file I/O. Results
+    are collected in host config order, so the output doesn't depend on timing.
+    `host_config` is loaded with get_host_config() unless it is given.
+    """
+    host_config = host_config or get_host_config()
+    cache = cache or FactCache()
+
+    machines = {category: [] for category in CATEGORY_FIELDS}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(lambda host: get_host_properties(data_path, host, cache), host_config["hosts"]):
+            if result is not None:
+                category, properties = result
+                machines[category].append(properties)
 
     return {
         "machines": {
-            "legacy_general_use_machines": sorted(legacy_general_use_machines, key=lambda m: int(m["cpu_info"].get("logical_processors", 0)), reverse=True),
-            "slurm_compute_nodes": sorted(slurm_compute_nodes, key=lambda m: int(m["cpu_info"].get("logical_processors", 0)), reverse=True),
-            "slurm_login_nodes": sorted(slurm_login_nodes, key=lambda m: int(m["cpu_info"].get("logical_processors", 0)), reverse=True),
-            "bare_metals": sorted(bare_metals, key=lambda m: int(m["cpu_info"].get("logical_processors", 0)), reverse=True),
-            "bastions": sorted(bastions, key=lambda m: int(m["cpu_info"].get("logical_processors", 0)), reverse=True),
+            category: sorted(nodes, key=lambda m: int(m["cpu_info"].get("logical_processors", 0)), reverse=True)
+            for category, nodes in machines.items()
         },
         "global_user_disk_quotas": host_config["global_user_disk_quotas"],
     }
@@ -236,7 +481,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generate machine info from gathered data')
     parser.add_argument('data_path', type=str, help='Path to data')
     parser.add_argument('fixtures_path', type=str, help='Path to fixtures')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='Number of hosts whose facts are read in parallel')
+    parser.add_argument('--cache', type=str, help='Path of the parsed host fact cache to read and update')
     args = parser.parse_args()
-    fixtures = generate_fixtures(args.data_path)
+    cache = FactCache(args.cache)
+    fixtures = generate_fixtures(args.data_path, args.workers, cache)
+    cache.save()
     with open(Path(args.fixtures_path, "machine-info.json"), 'w') as file:
         json.dump(fixtures, file, indent=2)
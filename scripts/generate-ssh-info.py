@@ -32,8 +32,8 @@ def get_network_from_hostname(hostname, networks):
     return None
 
 
-def generate_network_graph():
-    host_config = get_host_config()
+def generate_network_graph(host_config=None):
+    host_config = host_config or get_host_config()
 
     networks = host_config["networks"]
     slurm_login_nodes = [
@@ -127,8 +127,8 @@ def path_sort_key(G, path: list[str]):
     """
     return (len(path), ) + tuple(-G.nodes[n].get("priority", 0) for n in path)
 
-def generate_ssh_info():
-    G = generate_network_graph()
+def generate_ssh_info(host_config=None):
+    G = generate_network_graph(host_config)
 
     print(
         f"Generated SSH network graph with {G.number_of_nodes()} graph nodes and {G.number_of_edges()} graph edges"
@@ -9,8 +9,7 @@ from directory.scripts.user_utils import get_all_users_raw_with_defaults
 
 app = typer.Typer()
 
-@app.command()
-def main():
+def generate_user_profiles():
     users = get_all_users_raw_with_defaults()
 
     ret = {}
@@ -20,7 +19,11 @@ def main():
                 "watcloud_public_profile": user["watcloud_public_profile"]
             }
 
-    print(json.dumps(ret, indent=2))
+    return ret
+
+@app.command()
+def main():
+    print(json.dumps(generate_user_profiles(), indent=2))
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Streaming HTML link and anchor extraction for the link validators.
+
+The extractor is event based (built on `html.parser.HTMLParser`), so a page is
+processed in a single pass without building a DOM tree.
+"""
+
+from html.parser import HTMLParser
+
+# Elements that never have content or an end tag
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+
+class LinkExtractor(HTMLParser):
+    """
+    Collects the `href` of every `<a>` element along with its position, and
+    every `id` and `name` attribute (the targets of URL fragments).
+
+    Positions are recorded in a per-document element table built during the same
+    pass: each element is stored as (parent element, tag, 1-based index among
+    same-tag siblings). XPaths are only built from it when needed (see get_xpath).
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links: list[tuple[str, int]] = [] # (href, element)
+        self.anchors: set[str] = set()
+        self.elements: list[tuple[int, str, int]] = [] # (parent element, tag, sibling index)
+        # Open elements as (tag, element, child counts by tag). The first entry is the document.
+        self._stack: list[tuple[str, int, dict[str, int]]] = [("", -1, {})]
+
+    def handle_starttag(self, tag, attrs):
+        _, parent, child_counts = self._stack[-1]
+        child_counts[tag] = child_counts.get(tag, 0) + 1
+        element = len(self.elements)
+        self.elements.append((parent, tag, child_counts[tag]))
+
+        for name, value in attrs:
+            if name in ("id", "name") and value:
+                self.anchors.add(value)
+            elif name == "href" and tag == "a":
+                self.links.append((value or "", element))
+
+        if tag not in VOID_ELEMENTS:
+            self._stack.append((tag, element, {}))
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closing tags (e.g. `<a />`) have no children
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self._stack.pop()
+
+    def handle_endtag(self, tag):
+        # Close the most recent matching element, implicitly closing any
+        # unclosed elements inside it. Stray end tags are ignored.
+        for i in range(len(self._stack) - 1, 0, -1):
+            if self._stack[i][0] == tag:
+                del self._stack[i:]
+                return
+
+
+def compact_elements(links: list[tuple[str, int]], elements: list[tuple[int, str, int]]):
+    """
+    Drop the elements that are not links or ancestors of links, so that only
+    what is needed to compute the XPaths of links is kept.
+    Returns: (links, elements), with element indices remapped
+    """
+    keep = set()
+    for _, element in links:
+        while element != -1 and element not in keep:
+            keep.add(element)
+            element = elements[element][0]
+
+    # Parents come before their children, so the compact table stays in document order
+    kept = sorted(keep)
+    remap = {old: new for new, old in enumerate(kept)}
+    remap[-1] = -1
+    compact = [(remap[elements[i][0]], elements[i][1], elements[i][2]) for i in kept]
+    return [(href, remap[element]) for href, element in links], compact
+
+
+def get_xpath(elements: list, element: int) -> str:
+    """Build the XPath of an element from an element table."""
+    parts = []
+    while element != -1:
+        element, tag, index = elements[element]
+        parts.append(f"{tag}[{index}]")
+    parts.reverse()
+    return '/' + '/'.join(parts)
+
+
+def extract_links(html: str):
+    """
+    Extract links and anchors from an HTML document in one pass.
+    Returns: ([(href, element), ...], {id or name, ...}, element table for get_xpath)
+    """
+    extractor = LinkExtractor()
+    extractor.feed(html)
+    extractor.close()
+    links, elements = compact_elements(extractor.links, extractor.elements)
+    return links, extractor.anchors, elements
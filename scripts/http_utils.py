@@ -0,0 +1,182 @@
+"""
+Shared HTTP clients for the link validators.
+
+Internal pages are fetched through one pooled `requests.Session` per process
+(get_session), so connections to the site are kept alive and reused by all
+crawl workers instead of being opened for every page. External links are
+checked with a curl_cffi session (create_async_session), which pools
+connections as well and negotiates HTTP/2 with servers that support it.
+`requests` only speaks HTTP/1.1, which is fine for the site itself.
+
+Both clients use REQUEST_TIMEOUT by default and retry connection errors and
+timeouts RETRIES times. Every request and every newly opened connection is
+counted per host in STATS, so connection reuse can be reported at the end of a
+run (see print_connection_stats). Each request's latency, retries, bytes and
+outcome is recorded in report_utils.RECORDER.
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from curl_cffi import CurlECode, CurlInfo
+from curl_cffi.curl import CURL_WRITEFUNC_ERROR
+from curl_cffi import requests as curl_requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from report_utils import RECORDER
+
+REQUEST_TIMEOUT = 15 # seconds
+RETRIES = 2 # Retries after connection errors and timeouts (HTTP errors are not retried)
+RETRY_BACKOFF = 0.5 # seconds, doubled after every retry
+POOL_SIZE = 10 # Connections kept alive per host, should match the number of workers
+
+
+class ConnectionStats:
+    """Thread-safe per-host counters of requests sent and connections opened."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts: dict[str, dict[str, int]] = {}
+
+    def _count(self, host: str, key: str, n: int = 1) -> None:
+        with self.lock:
+            counters = self.hosts.setdefault(host or "", {"requests": 0, "connections": 0})
+            counters[key] += n
+
+    def record_request(self, url: str) -> None:
+        self._count(urlparse(url).hostname, "requests")
+
+    def record_connections(self, url: str, n: int = 1) -> None:
+        self._count(urlparse(url).hostname, "connections", n)
+
+    def summary(self) -> dict[str, dict[str, int]]:
+        """{host: {"requests", "connections", "reused"}}. Requests not sent on a new connection reused one."""
+        with self.lock:
+            return {host: {**c, "reused": max(0, c["requests"] - c["connections"])}
+                    for host, c in sorted(self.hosts.items())}
+
+
+STATS = ConnectionStats()
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        STATS.record_connections(f"{self.scheme}://{self.host}")
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        STATS.record_connections(f"{self.scheme}://{self.host}")
+        return super()._new_conn()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    An adapter that keeps `pool_size` connections per host alive, applies
+    REQUEST_TIMEOUT to requests without an explicit timeout, retries connection
+    errors and timeouts, and records requests and new connections in STATS and
+    RECORDER. Unless the request is streamed, the body is read before the request is recorded.
+    """
+    def __init__(self, pool_size: int = POOL_SIZE):
+        retry = Retry(total=RETRIES, backoff_factor=RETRY_BACKOFF, status=0,
+                      respect_retry_after_header=False, raise_on_status=False)
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, timeout=None, stream=False, **kwargs):
+        STATS.record_request(request.url)
+        start = time.perf_counter()
+        try:
+            response = super().send(request, timeout=timeout or REQUEST_TIMEOUT, stream=stream, **kwargs)
+            size = 0 if stream else len(response.content)
+        except requests.RequestException as e:
+            RECORDER.record_request(request.url, request.method, time.perf_counter() - start,
+                                    type(e).__name__, retries=RETRIES)
+            raise
+        retries = response.raw.retries
+        RECORDER.record_request(request.url, request.method, time.perf_counter() - start, "ok",
+                                response.status_code, size, len(retries.history) if retries else 0)
+        return response
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """
+    The process-wide pooled session. The first call creates it with room for
+    `pool_size` concurrent connections per host.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = PooledHTTPAdapter(pool_size)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def create_async_session(max_clients: int) -> curl_requests.AsyncSession:
+    """
+    A curl_cffi session for up to `max_clients` concurrent requests. Responses
+    carry the number of connections curl opened for them (see async_request).
+    """
+    return curl_requests.AsyncSession(max_clients=max_clients, timeout=REQUEST_TIMEOUT,
+                                      curl_infos=[CurlInfo.NUM_CONNECTS])
+
+
+async def async_request(session: curl_requests.AsyncSession, method: str, url: str,
+                        retries: int = 0, headers_only: bool = False, **kwargs) -> curl_requests.Response:
+    """
+    Make a request with a session from create_async_session and record it in
+    STATS and RECORDER. `retries` is the number of earlier attempts at the same
+    request. With `headers_only`, curl aborts the transfer when the first chunk
+    of the body arrives, and the response is returned without content. Only the
+    bytes of that chunk are received and recorded.
+    """
+    received = []
+    def abort_transfer(chunk):
+        received.append(len(chunk))
+        return CURL_WRITEFUNC_ERROR
+    if headers_only:
+        kwargs["content_callback"] = abort_transfer
+
+    STATS.record_request(url)
+    start = time.perf_counter()
+    try:
+        try:
+            response = await session.request(method, url, **kwargs)
+        except curl_requests.exceptions.RequestException as e:
+            # Aborting surfaces as a write error, after the headers were parsed
+            if not (received and e.code == CurlECode.WRITE_ERROR and e.response is not None):
+                raise
+            response = e.response
+        size = sum(received) if headers_only else len(response.content)
+    except curl_requests.exceptions.RequestException as e:
+        RECORDER.record_request(url, method, time.perf_counter() - start, type(e).__name__, retries=retries)
+        raise
+    STATS.record_connections(url, response.infos.get(CurlInfo.NUM_CONNECTS, 0))
+    RECORDER.record_request(url, method, time.perf_counter() - start, "ok", response.status_code,
+                            size, retries)
+    return response
+
+
+def print_connection_stats() -> None:
+    summary = STATS.summary()
+    if not summary:
+        return
+    print("Connections by host:")
+    for host, counters in summary.items():
+        print(f"\t{host}: {counters['requests']} requests, {counters['connections']} connections opened, "
+              f"{counters['reused']} reused")
@@ -0,0 +1,164 @@
+"""
+Structured timing report for the link validators.
+
+Every HTTP request made through http_utils is recorded in RECORDER with its
+latency, retries, bytes received and outcome. The validators also time their
+phases (e.g. crawl, check, fragment) and add the broken links they find. At the
+end of a run, the recorder is turned into a JSON report with latency
+histograms and the slowest hosts (write_json_report), and optionally a JUnit
+XML file in which every broken link is a failed test case (write_junit_report).
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from xml.etree import ElementTree
+
+REPORT_VERSION = 1
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000] # Upper bounds of histogram buckets
+SLOWEST_COUNT = 10 # Number of slowest hosts and requests to report
+
+
+class RunRecorder:
+    """Thread-safe collection of request records, phase timings and broken links."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.requests: list[dict] = []
+        self.phases: dict[str, float] = {}
+        self.broken_links: list[dict] = []
+
+    def record_request(self, url: str, method: str, latency: float, outcome: str,
+                       status_code: int | None = None, size: int = 0, retries: int = 0) -> None:
+        """
+        Record a request. `outcome` is "ok" for any HTTP response (see
+        `status_code`), otherwise the name of the error. `retries` counts the
+        attempts before this one.
+        """
+        record = {
+            "url": url,
+            "host": urlparse(url).hostname or "",
+            "method": method,
+            "latency_ms": round(latency * 1000, 3),
+            "outcome": outcome,
+            "status_code": status_code,
+            "bytes": size,
+            "retries": retries,
+        }
+        with self.lock:
+            self.requests.append(record)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Add the time spent in the block to phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_broken_link(self, **fields) -> None:
+        with self.lock:
+            self.broken_links.append(fields)
+
+
+RECORDER = RunRecorder()
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize_requests(requests: list[dict]) -> dict:
+    """Counts, retried requests, bytes, outcomes and a latency histogram of a list of request records."""
+    latencies = sorted(r["latency_ms"] for r in requests)
+    histogram = {f"<={bound}": 0 for bound in LATENCY_BUCKETS_MS}
+    histogram[f">{LATENCY_BUCKETS_MS[-1]}"] = 0
+    for latency in latencies:
+        bound = next((b for b in LATENCY_BUCKETS_MS if latency <= b), None)
+        histogram[f"<={bound}" if bound is not None else f">{LATENCY_BUCKETS_MS[-1]}"] += 1
+
+    outcomes = {}
+    for r in requests:
+        outcome = str(r["status_code"]) if r["outcome"] == "ok" else r["outcome"]
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    return {
+        "count": len(requests),
+        "retried": sum(1 for r in requests if r["retries"]),
+        "bytes": sum(r["bytes"] for r in requests),
+        "outcomes": dict(sorted(outcomes.items())),
+        "latency_ms": {
+            "total": round(sum(latencies), 3),
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "max": latencies[-1] if latencies else 0.0,
+            "histogram": histogram,
+        },
+    }
+
+
+def build_report(validator: str, base_url: str, recorder: RunRecorder = RECORDER) -> dict:
+    with recorder.lock:
+        requests = list(recorder.requests)
+        phases = dict(recorder.phases)
+        broken_links = list(recorder.broken_links)
+
+    by_host = {}
+    for r in requests:
+        by_host.setdefault(r["host"], []).append(r)
+    hosts = {host: summarize_requests(host_requests) for host, host_requests in sorted(by_host.items())}
+    slowest_hosts = sorted(hosts, key=lambda h: hosts[h]["latency_ms"]["total"], reverse=True)[:SLOWEST_COUNT]
+
+    return {
+        "version": REPORT_VERSION,
+        "validator": validator,
+        "base_url": base_url,
+        "started_at": recorder.started_at.isoformat(),
+        "duration_seconds": round(time.perf_counter() - recorder.start, 3),
+        "phases_seconds": {name: round(seconds, 3) for name, seconds in phases.items()},
+        "requests": summarize_requests(requests),
+        "slowest_hosts": [{"host": host, **hosts[host]} for host in slowest_hosts],
+        "slowest_requests": sorted(requests, key=lambda r: r["latency_ms"], reverse=True)[:SLOWEST_COUNT],
+        "hosts": hosts,
+        "broken_links": broken_links,
+        "request_log": requests,
+    }
+
+
+def write_json_report(report: dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote timing report to {path}")
+
+
+def write_junit_report(report: dict, path: str) -> None:
+    """
+    Write the report as JUnit XML: one passing test case per phase (with its
+    time) and one failed test case per broken link.
+    """
+    suite = ElementTree.Element("testsuite", {
+        "name": f"{report['validator']}-links",
+        "tests": str(len(report["phases_seconds"]) + len(report["broken_links"])),
+        "failures": str(len(report["broken_links"])),
+        "time": str(report["duration_seconds"]),
+        "timestamp": report["started_at"],
+    })
+    for name, seconds in report["phases_seconds"].items():
+        ElementTree.SubElement(suite, "testcase", {"classname": "phases", "name": name, "time": str(seconds)})
+    for link in report["broken_links"]:
+        case = ElementTree.SubElement(suite, "testcase", {"classname": "broken_links", "name": link["url"]})
+        failure = ElementTree.SubElement(case, "failure", {"message": link.get("reason", "")})
+        failure.text = json.dumps(link, indent=2)
+
+    ElementTree.indent(suite)
+    ElementTree.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+    print(f"Wrote JUnit report to {path}")
@@ -5,21 +5,50 @@ if broken external links on a website *statefully*. If a link has been UP at
 least once in the last `GRACE_DAYS` days, the outage is ignored and considered
 temporary.
 
+Incremental mode: with `--ttl-hours`, links that were verified OK within the TTL
+are not re-checked. `--recheck-fraction` re-checks that fraction of the fresh
+links anyway (the least recently checked first), so that re-verification is
+spread over runs.
+
+Offline mode: with `--out-dir`, internal pages are read from the static export
+on disk instead of being fetched from BASE_URL. With `--crawl-artifact`, the link
+graph is read from an artifact written by crawl-site.py instead of crawling.
+
+Reports: with `--report`, a JSON report with per-request latency, retries,
+bytes and outcomes, latency histograms, the slowest hosts, the time spent per
+phase and the broken links is written (see report_utils). `--junit` writes the
+phases and broken links as JUnit XML.
+
 Note: treats a link as external if and only if it doesn't direct to a subpage
-of the base URL
+of the base URL or the deployed domain (see crawl_utils.is_internal_url)
 
 Usage:
-    python3 validate-external-links.py <BASE_URL> <STATE_READ_PATH> <STATE_WRITE_PATH>
+    python3 validate-external-links.py <BASE_URL> <STATE_READ_PATH> <STATE_WRITE_PATH> [--ttl-hours H] [--recheck-fraction F] [--out-dir OUT_DIR] [--crawl-artifact ARTIFACT_PATH] [--crawl-workers N] [--parse-workers N] [--report REPORT_PATH] [--junit JUNIT_PATH]
 """
 
-from bs4 import BeautifulSoup
 from curl_cffi import requests
-from urllib.parse import urljoin, urldefrag, urlparse
+from urllib.parse import urldefrag, urlparse
 from datetime import datetime, timedelta, timezone
-import json, os, sys, time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+import argparse, asyncio, json, math, os, sys
+
+from crawl_utils import CRAWL_WORKERS, PARSE_WORKERS, crawl_site, load_crawl
+from export_utils import StaticExport
+from http_utils import RETRIES, async_request, create_async_session, print_connection_stats
+from report_utils import RECORDER, build_report, write_json_report, write_junit_report
 
 GRACE_DAYS = 3 # Ignore link outages if they worked recently
 BACKOFF_BASE = 10 # base (seconds) for linear or exponential backoffs
+MAX_CONCURRENCY = 20 # Maximum number of external requests in flight
+MAX_CONCURRENCY_PER_HOST = 4 # Maximum number of requests in flight to a single host
+
+# Per-host (requests per second, burst) token buckets for hosts that are quick
+# to rate limit us. Other hosts are only bounded by MAX_CONCURRENCY_PER_HOST.
+DOMAIN_RATE_LIMITS = {
+    "github.com": (2, 5),
+    "www.linkedin.com": (0.5, 2),
+}
 
 # Broken links that match these exactly will be ignored.
 # Since these links are external, these links will not be recursed on
@@ -56,26 +85,61 @@ CLEANED_WHITELISTED_URLS = [clean_url(url) for url in WHITELISTED_URLS]
 CLEANED_WHITELISTED_PREFIXES = [clean_url(url) for url in WHITELISTED_PREFIXES]
 
 
-if len(sys.argv) < 4:
-    print(f"Usage: python3 {__file__} <BASE_URL> <STATE_READ_PATH> <STATE_WRITE_PATH>")
-    sys.exit(1)
-
-BASE_URL = sys.argv[1]
-STATE_READ_PATH = sys.argv[2]
-STATE_WRITE_PATH = sys.argv[3]
+parser = argparse.ArgumentParser(description="Detect broken external links on a website")
+parser.add_argument("base_url", type=str, help="URL of the website to crawl")
+parser.add_argument("state_read_path", type=str, help="Path to read the link state from")
+parser.add_argument("state_write_path", type=str, help="Path to write the link state to")
+parser.add_argument("--ttl-hours", type=float, default=0,
+                    help="Skip links that were verified OK within this many hours (0 disables)")
+parser.add_argument("--recheck-fraction", type=float, default=0,
+                    help="Fraction of fresh links to re-check anyway, least recently checked first")
+parser.add_argument("--out-dir", type=str,
+                    help="Read internal pages from this static export directory instead of fetching them")
+parser.add_argument("--crawl-artifact", type=str,
+                    help="Read the link graph from this crawl artifact instead of crawling")
+parser.add_argument("--crawl-workers", type=int, default=CRAWL_WORKERS,
+                    help="Number of internal pages to fetch in parallel while crawling")
+parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS,
+                    help="Number of processes parsing HTML while crawling (0 parses in the crawl threads)")
+parser.add_argument("--report", type=str, help="Write a JSON timing and latency report to this path")
+parser.add_argument("--junit", type=str, help="Write the phases and broken links as JUnit XML to this path")
+args = parser.parse_args()
+
+BASE_URL = args.base_url
+STATE_READ_PATH = args.state_read_path
+STATE_WRITE_PATH = args.state_write_path
+FRESHNESS_TTL = timedelta(hours=args.ttl_hours)
+RECHECK_FRACTION = args.recheck_fraction
+EXPORT = StaticExport(args.out_dir, BASE_URL) if args.out_dir else None
 
 print(f"INFO: Base URL: {BASE_URL}")
 print(f"INFO: State read path: {STATE_READ_PATH}")
 print(f"INFO: State write path: {STATE_WRITE_PATH}")
+print(f"INFO: Freshness TTL: {FRESHNESS_TTL} (re-check fraction {RECHECK_FRACTION})")
+
+# Fields of a state entry that hold timestamps
+STATE_TIME_FIELDS = ["last_ok", "last_checked"]
 
 def _now() -> datetime:
     return datetime.now(timezone.utc)
 
-def load_state(path: str) -> dict[str, datetime]:
+def _parse_state_entry(raw) -> dict:
+    # Older state files only stored the last OK timestamp
+    if isinstance(raw, str):
+        raw = {"last_ok": raw}
+    return {k: datetime.fromisoformat(v) if k in STATE_TIME_FIELDS and v else v
+            for k, v in raw.items()}
+
+def load_state(path: str) -> dict[str, dict]:
+    """
+    Load the per-URL state. Each entry may contain `last_ok` and `last_checked`
+    timestamps, the `last_outcome` ("ok" or "broken"), the last status `code`
+    and the `etag`/`last_modified` validators of the last OK response.
+    """
     try:
         with open(path, "r") as f:
             raw = json.load(f)
-        ret = {k: datetime.fromisoformat(v) for k, v in raw.items()}
+        ret = {k: _parse_state_entry(v) for k, v in raw.items()}
         print(f"INFO: Loaded {len(ret)} state objects from {path}")
         return ret
     except FileNotFoundError:
@@ -85,38 +149,126 @@ def load_state(path: str) -> dict[str, datetime]:
         print(f"WARNING: could not load state file {path}: {e}, starting fresh")
         return {}
 
-def save_state(state: dict[str, datetime], path: str) -> None:
+def save_state(state: dict[str, dict], path: str) -> None:
     print(f"INFO: Saving {len(state)} state objects to {path}")
     with open(path, "w") as f:
-        json.dump({k: v.isoformat() for k, v in state.items()}, f, indent=2)
+        json.dump({
+            url: {k: v.isoformat() if k in STATE_TIME_FIELDS and v else v for k, v in entry.items()}
+            for url, entry in state.items()
+        }, f, indent=2)
+
+def is_fresh(entry: dict | None, now: datetime) -> bool:
+    """Whether a link was verified OK within the freshness TTL."""
+    if not entry or entry.get("last_outcome") != "ok" or not entry.get("last_checked"):
+        return False
+    return entry["last_checked"] > now - FRESHNESS_TTL
+
+def select_links_to_skip(dests, state: dict[str, dict], now: datetime) -> set[str]:
+    """
+    Return the destinations that are fresh enough to skip. The least recently
+    checked RECHECK_FRACTION of the fresh destinations are re-checked anyway.
+    """
+    fresh = sorted((d for d in dests if is_fresh(state.get(d), now)),
+                   key=lambda d: state[d]["last_checked"])
+    recheck_count = math.ceil(len(fresh) * RECHECK_FRACTION)
+    return set(fresh[recheck_count:])
 
 class ExternalLink:
-    def __init__(self, is_broken: bool, page: str,
-                 dest: str, code: int, err_str: str):
+    def __init__(self, is_broken: bool, pages: list[str],
+                 dest: str, code: int, err_str: str, validators: dict = None):
         self.is_broken = is_broken  # Whether the link is broken or not
-        self.page = page            # The internal page that the link is located in
+        self.pages = pages          # The internal pages that the link is located in
         self.dest = dest            # The external site the link directs to
         self.code = code            # The status code returned from the external site
         self.err_str = err_str      # The meaning of the status code
-
-
-def recursively_fetch_internal_pages(visited, url) -> None:
-    if is_external_url(url):
-        return
-
-    if url in visited:
-        return
-
-    visited.add(url)
-    links = get_links_on_page(url)
-    for link in links:
-        # Recurse on links ignoring fragments for efficiency
-        defragged_link, _ = urldefrag(link)
-        recursively_fetch_internal_pages(visited, defragged_link)
-
-
-def is_external_url(url):
-    return not url.startswith(BASE_URL.rstrip("/"))
+        self.validators = validators or {}  # ETag/Last-Modified for conditional requests
+
+
+class HostLimiter:
+    """
+    Schedules requests to a single host. An optional token bucket throttles the
+    request rate, and a host that answered 429 is parked until its Retry-After
+    time has passed. Waiters are served in FIFO order.
+    """
+    def __init__(self, max_concurrency: int, rate: float | None = None, burst: int = 1):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.lock = asyncio.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = asyncio.get_running_loop().time()
+        self.not_before = 0.0
+
+    async def wait_turn(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            while True:
+                now = loop.time()
+                if now < self.not_before:
+                    await asyncio.sleep(self.not_before - now)
+                    continue
+                if self.rate is None:
+                    return
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def defer(self, seconds: float) -> None:
+        self.not_before = max(self.not_before, asyncio.get_running_loop().time() + seconds)
+
+
+class HostScheduler:
+    """
+    Caps the number of in-flight requests globally and per host, and applies
+    per-host rate limits. Only requests that are ready to be sent hold a global
+    slot, so a throttled or parked host never stalls checks against other hosts.
+    """
+    def __init__(self, max_total: int, max_per_host: int, rate_limits: dict[str, tuple[float, int]]):
+        self.total = asyncio.Semaphore(max_total)
+        self.max_per_host = max_per_host
+        self.rate_limits = rate_limits
+        self.hosts: dict[str, HostLimiter] = {}
+
+    def get_host(self, url: str) -> HostLimiter:
+        host = urlparse(url).hostname or ""
+        if host not in self.hosts:
+            rate, burst = self.rate_limits.get(host, (None, 1))
+            self.hosts[host] = HostLimiter(self.max_per_host, rate, burst)
+        return self.hosts[host]
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        host = self.get_host(url)
+        async with host.semaphore:
+            await host.wait_turn()
+            async with self.total:
+                yield
+
+    def defer(self, url: str, seconds: float) -> None:
+        """Park the host of `url` for `seconds`. Queued requests to it wait; others proceed."""
+        self.get_host(url).defer(seconds)
+
+
+def normalize_url(url):
+    """
+    Normalize a link to the destination that is actually requested. Fragments are
+    never sent to the server, and scheme and host are case-insensitive.
+    """
+    parsed = urlparse(urldefrag(url)[0])
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower()).geturl()
+
+
+def parse_retry_after(value) -> float | None:
+    """Parse a Retry-After header, given either in seconds or as an HTTP date."""
+    if is_number(value):
+        return float(value)
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - _now()).total_seconds())
+    except (TypeError, ValueError):
+        return None
 
 
 def is_number(value):
@@ -129,17 +281,58 @@ def is_number(value):
         return False
 
 
-def check_link(url: str, page: str, attempt: int = 1) -> ExternalLink:
-    print(f"Checking link {url} on page {page} (attempt {attempt})")
+def get_conditional_headers(validators: dict) -> dict:
+    """Headers that let the server answer 304 if the link hasn't changed since the last check."""
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def get_response_validators(response) -> dict:
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return {k: v for k, v in validators.items() if v}
+
+
+async def probe_link(session: requests.AsyncSession, url: str, headers: dict, timeout: float, retries: int = 0):
+    """
+    Fetch only what is needed to classify a link. Try HEAD first, and fall back
+    to a GET that is aborted once the headers arrive, because many servers reject
+    or mishandle HEAD requests.
+    """
+    response = await async_request(session, "HEAD", url, retries, headers=headers, allow_redirects=True,
+                                   impersonate="safari", timeout=timeout)
+    # Retrying a rate-limited host with GET would only make matters worse
+    if response.status_code in (200, 304, 429):
+        return response
+
+    return await async_request(session, "GET", url, retries, headers=headers, allow_redirects=True,
+                               impersonate="safari", timeout=timeout, headers_only=True)
+
+
+async def check_link(session: requests.AsyncSession, scheduler: HostScheduler,
+                     url: str, pages: list[str], validators: dict,
+                     attempt: int = 1) -> ExternalLink:
+    print(f"Checking link {url} found on {len(pages)} page(s) (attempt {attempt})")
     try:
-        request_response = requests.get(url, allow_redirects=True,
-                                        impersonate="safari", timeout=BACKOFF_BASE*attempt)
+        async with scheduler.slot(url):
+            request_response = await probe_link(session, url, get_conditional_headers(validators),
+                                                timeout=BACKOFF_BASE*attempt, retries=attempt - 1)
 
         # Get the HTTP status code
         request_code = request_response.status_code
 
         if request_code == 200:
-            return ExternalLink(False, page, url, request_code, "")
+            return ExternalLink(False, pages, url, request_code, "",
+                                get_response_validators(request_response))
+        if request_code == 304:
+            # Not modified since it was last verified OK
+            return ExternalLink(False, pages, url, request_code, "", validators)
 
         # Consider these status codes as broken
         if request_code == 401:
@@ -150,11 +343,11 @@ def check_link(url: str, page: str, attempt: int = 1) -> ExternalLink:
             err_str = "Page not found"
         elif request_code == 429:
             err_str = "Too many requests"
-            retry_after = request_response.headers.get("Retry-After")
+            retry_after = parse_retry_after(request_response.headers.get("Retry-After"))
             backoff_seconds = BACKOFF_BASE * attempt
-            retry_duration = int(retry_after) if is_number(retry_after) else backoff_seconds
-            print(f"\tRate limit hit, retrying in {retry_duration} seconds...")
-            time.sleep(retry_duration)
+            retry_duration = retry_after if retry_after is not None else backoff_seconds
+            print(f"\tRate limit hit, deferring {urlparse(url).hostname} for {retry_duration} seconds...")
+            scheduler.defer(url, retry_duration)
         elif request_code >= 400 and request_code < 500:
             err_str = "Client error"
         elif request_code >= 500:
@@ -168,36 +361,39 @@ def check_link(url: str, page: str, attempt: int = 1) -> ExternalLink:
         else:
             err_str = "Unspecified error"
 
-        if attempt < 3:
-            print(f"WARNING: Failed to fetch {url} (attempt {attempt} of 3)")
-            return check_link(url, page, attempt + 1)
-        return ExternalLink(True, page, url, request_code, err_str)
+        if attempt <= RETRIES:
+            print(f"WARNING: Failed to fetch {url} (attempt {attempt} of {RETRIES + 1})")
+            return await check_link(session, scheduler, url, pages, validators, attempt + 1)
+        return ExternalLink(True, pages, url, request_code, err_str)
 
     except requests.exceptions.Timeout:
-        if attempt < 3:
-            return check_link(url, page, attempt + 1)
-        return ExternalLink(True, page, url, -1, "Timeout")
+        if attempt <= RETRIES:
+            return await check_link(session, scheduler, url, pages, validators, attempt + 1)
+        return ExternalLink(True, pages, url, -1, "Timeout")
     except requests.exceptions.RequestException as e:
         # Any error like connection issues are treated as broken links
-        if attempt < 3:
-            return check_link(url, page, attempt + 1)
-        return ExternalLink(True, page, url, -1, f'Request exception: {str(e)}')
-
-
-def get_links_on_page(url):
-    try:
-        response = requests.get(url)
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Extract all anchor tags with href attributes
-        all_links = [a.get('href') for a in soup.find_all('a', href=True)]
-        filtered_links = [url for url in all_links if urlparse(url).scheme in SCHEMES]
-
-        # Join relative URLs with the base URL to form complete links
-        return [urljoin(url, link) for link in filtered_links]
-    except:
-        return []
+        if attempt <= RETRIES:
+            return await check_link(session, scheduler, url, pages, validators, attempt + 1)
+        return ExternalLink(True, pages, url, -1, f'Request exception: {str(e)}')
+
+
+async def check_links(pages_by_dest: dict[str, list[str]], state: dict[str, dict]) -> list[ExternalLink]:
+    """
+    Check each destination exactly once, concurrently, bounded by MAX_CONCURRENCY,
+    MAX_CONCURRENCY_PER_HOST and DOMAIN_RATE_LIMITS. Each result lists every page
+    that references it.
+    Validators from links that were OK last time are sent as conditional headers.
+    """
+    def get_validators(dest):
+        entry = state.get(dest, {})
+        if entry.get("last_outcome") != "ok":
+            return {}
+        return {k: entry[k] for k in ("etag", "last_modified") if entry.get(k)}
+
+    scheduler = HostScheduler(MAX_CONCURRENCY, MAX_CONCURRENCY_PER_HOST, DOMAIN_RATE_LIMITS)
+    async with create_async_session(MAX_CONCURRENCY) as session:
+        return await asyncio.gather(*(check_link(session, scheduler, dest, pages, get_validators(dest))
+                                      for dest, pages in pages_by_dest.items()))
 
 
 def is_whitelisted(url):
@@ -215,50 +411,95 @@ def is_whitelisted(url):
 
 if __name__ == "__main__":
     state = load_state(STATE_READ_PATH)
-    cutoff = _now() - timedelta(days=GRACE_DAYS)
+    now = _now()
+    cutoff = now - timedelta(days=GRACE_DAYS)
 
-    internal_urls = set()
-    print("Recursively fetching internal pages...")
-    recursively_fetch_internal_pages(internal_urls, BASE_URL)
-    print(f"Fetched {len(internal_urls)} internal pages")
+    with RECORDER.phase("crawl"):
+        if args.crawl_artifact:
+            print(f"Loading crawl artifact {args.crawl_artifact}...")
+            crawl = load_crawl(args.crawl_artifact)
+        else:
+            print("Crawling internal pages...")
+            crawl = crawl_site(BASE_URL, EXPORT, args.crawl_workers, parse_workers=args.parse_workers)
+    print(f"Fetched {len(crawl['pages'])} internal pages")
 
     print("Checking external links...")
     whitelist_ignores_count = 0
-    external_links = []
+    link_count = 0
+    pages_by_dest: dict[str, list[str]] = {}
 
-    for internal_url in internal_urls:
-        for link in get_links_on_page(internal_url):
+    for internal_url, page in crawl["pages"].items():
+        for crawled_link in page["links"]:
+            link = crawled_link["url"]
+            if urlparse(link).scheme not in SCHEMES:
+                continue
             if is_whitelisted(link):
                 whitelist_ignores_count += 1
                 print(f"INFO: Ignoring whitelisted link {link}")
                 continue
-            if is_external_url(link):
-                external_links.append(check_link(link, internal_url))
+            if not crawled_link["internal"]:
+                link_count += 1
+                pages = pages_by_dest.setdefault(normalize_url(link), [])
+                if internal_url not in pages:
+                    pages.append(internal_url)
+
+    fresh_dests = select_links_to_skip(pages_by_dest, state, now)
+    for dest in fresh_dests:
+        print(f"INFO: Skipping {dest} (last verified OK {state[dest]['last_checked'].isoformat()})")
+    pages_by_dest = {d: p for d, p in pages_by_dest.items() if d not in fresh_dests}
+
+    print(f"Checking {len(pages_by_dest)} distinct destinations for {link_count} external links...")
+    with RECORDER.phase("check"):
+        external_links = asyncio.run(check_links(pages_by_dest, state))
             
     broken_count = 0
     for external_link in external_links:
+        entry = state.setdefault(external_link.dest, {})
+        entry.update({
+            "last_checked": _now(),
+            "last_outcome": "broken" if external_link.is_broken else "ok",
+            "code": external_link.code,
+        })
 
         if not external_link.is_broken:
-            state[external_link.dest] = _now()
+            entry["last_ok"] = entry["last_checked"]
+            entry.pop("etag", None)
+            entry.pop("last_modified", None)
+            entry.update(external_link.validators)
             continue
         
-        last_ok = state.get(external_link.dest)
+        last_ok = entry.get("last_ok")
         if last_ok and last_ok > cutoff:
             print(f"WARNING: ignoring outage for {external_link.dest} (last OK {last_ok.isoformat()}) which is in the last {GRACE_DAYS} days")
             continue
 
         broken_count += 1
-        print(f"ERROR: Broken link to {external_link.dest} found last reporting status code {external_link.code} on {external_link.page}")
+        RECORDER.add_broken_link(url=external_link.dest, status_code=external_link.code,
+                                 reason=external_link.err_str, pages=sorted(external_link.pages))
+        print(f"ERROR: Broken link to {external_link.dest} found last reporting status code {external_link.code} ({external_link.err_str}) on {len(external_link.pages)} page(s):")
+        for page in sorted(external_link.pages):
+            print(f"\t{page}")
 
-    # Prune stale entries from the state
-    prune_cutoff = _now() - timedelta(days=GRACE_DAYS)
-    state = {k: v for k, v in state.items() if v > prune_cutoff}
+    # Prune stale entries from the state. Entries are needed for the grace
+    # period and for skipping fresh links.
+    prune_cutoff = _now() - max(timedelta(days=GRACE_DAYS), FRESHNESS_TTL)
+    state = {k: v for k, v in state.items() if v.get("last_ok") and v["last_ok"] > prune_cutoff}
 
     print(f"INFO: Saving state to {STATE_WRITE_PATH}")
     save_state(state, STATE_WRITE_PATH)
 
+    print_connection_stats()
+    if args.report or args.junit:
+        report = build_report("external", BASE_URL)
+        if args.report:
+            write_json_report(report, args.report)
+        if args.junit:
+            write_junit_report(report, args.junit)
+
     print("DONE")
-    print(f"{len(external_links)} external links in total")
+    print(f"{link_count} external links in total")
+    print(f"{len(external_links)} distinct destinations checked")
+    print(f"{len(fresh_dests)} fresh destinations skipped")
     print(f"{whitelist_ignores_count} broken whitelisted links ignored")
     print(f"{broken_count} broken links")
 
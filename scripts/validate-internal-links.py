@@ -1,84 +1,146 @@
 """
 Purpose: Tool to detect broken internal links on a website before it reaches production.
 
-Use: python3 validate-internal-links.py <BASE_URL> 
+With --out-dir, pages are read from the static export on disk instead of being
+fetched from BASE_URL, so no HTTP server is needed. With --crawl-artifact, the
+link graph is read from an artifact written by crawl-site.py instead of
+crawling the site again.
+
+With --cache, page records and validation results are stored by page content
+hash. Unchanged pages are not parsed again, and their validation results are
+reused when the pages they link to are unchanged as well, so only the pages
+affected by a change are re-validated.
+
+With --report, a JSON report with per-request latency, retries, bytes and
+outcomes, latency histograms, the slowest hosts, the time spent per phase
+(crawl, check, fragment) and the broken links is written (see report_utils).
+--junit writes the phases and broken links as JUnit XML.
+
+Use: python3 validate-internal-links.py <BASE_URL> [--out-dir OUT_DIR] [--crawl-artifact ARTIFACT_PATH] [--crawl-workers N] [--max-depth D] [--parse-workers N] [--cache CACHE_PATH] [--report REPORT_PATH] [--junit JUNIT_PATH]
 """
 
+import argparse
+import hashlib
+import json
+import os
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urldefrag, urlparse
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+
+from crawl_utils import CRAWL_WORKERS, PARSE_WORKERS, crawl_site, fetch_page, get_link_xpath, load_crawl
+from export_utils import StaticExport
+from html_utils import extract_links
+from http_utils import print_connection_stats
+from report_utils import RECORDER, build_report, write_json_report, write_junit_report
 
 # CONFIG
-if len(sys.argv) < 2:
-    print("Usage: python3 check_links.py <BASE_URL>")
-    sys.exit(1)
+parser = argparse.ArgumentParser(description="Detect broken internal links on a website")
+parser.add_argument("base_url", type=str, help="URL of the website to crawl")
+parser.add_argument("--out-dir", type=str, help="Read pages from this static export directory instead of fetching them")
+parser.add_argument("--crawl-artifact", type=str, help="Read the link graph from this crawl artifact instead of crawling")
+parser.add_argument("--crawl-workers", type=int, default=CRAWL_WORKERS, help="Number of pages to fetch in parallel while crawling")
+parser.add_argument("--max-depth", type=int, help="Only crawl pages within this many links of BASE_URL")
+parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="Number of processes parsing HTML while crawling (0 parses in the crawl threads)")
+parser.add_argument("--cache", type=str, help="Path of the incremental validation cache to read and update")
+parser.add_argument("--report", type=str, help="Write a JSON timing and latency report to this path")
+parser.add_argument("--junit", type=str, help="Write the phases and broken links as JUnit XML to this path")
+args = parser.parse_args()
 
-BASE_URL = sys.argv[1] 
-DEPLOYED_DOMAIN = "https://cloud.watonomous.ca/"  # Where the build is deployed
+BASE_URL = args.base_url
+EXPORT = StaticExport(args.out_dir, BASE_URL) if args.out_dir else None
+
+CACHE_VERSION = 1
+CACHE_RECORD_FIELDS = {"status_code", "error", "hash", "anchors", "links", "elements"} # Fields of a crawled page record (see crawl_utils)
 
 fail_build = False
 
-def is_internal_url(url):
-    """Check if a URL is internal to the website."""
-    return url.startswith(BASE_URL) or url.startswith(DEPLOYED_DOMAIN)
+def load_validation_cache(path) -> dict:
+    """Load the per-page validation cache: {page url: {"record", "results_key", "invalid_links", "invalid_fragments"}}"""
+    try:
+        with open(path, "r") as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        print(f"Cache {path} not found, starting fresh")
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Could not load cache {path}: {e}. Starting fresh")
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+        version = cache.get("version") if isinstance(cache, dict) else None
+        print(f"Cache {path} has version {version}, expected {CACHE_VERSION}. Starting fresh")
+        return {}
+    if not isinstance(cache.get("pages"), dict):
+        print(f"Cache {path} is malformed. Starting fresh")
+        return {}
+    pages = {page_url: entry for page_url, entry in cache["pages"].items() if is_valid_cache_entry(entry)}
+    if len(pages) < len(cache["pages"]):
+        print(f"Dropped {len(cache['pages']) - len(pages)} malformed entries from cache {path}")
+    return pages
+
+def is_valid_cache_entry(entry) -> bool:
+    """Whether a validation cache entry has every field this script reads."""
+    return (isinstance(entry, dict)
+            and isinstance(entry.get("record"), dict) and CACHE_RECORD_FIELDS <= entry["record"].keys()
+            and "results_key" in entry and (entry["results_key"] is None or isinstance(entry["results_key"], str))
+            and isinstance(entry.get("invalid_links"), list)
+            and all(isinstance(link, list) and len(link) == 3 for link in entry["invalid_links"])
+            and isinstance(entry.get("invalid_fragments"), list)
+            and all(isinstance(link, list) and len(link) == 2 for link in entry["invalid_fragments"]))
 
-def convert_deployed_domain_to_base(url):
-    """Convert a URL from the deployed domain to the base URL."""
-    if url.startswith(DEPLOYED_DOMAIN):
-        return url.replace(DEPLOYED_DOMAIN, BASE_URL)
-    else:
-        return url
+def save_validation_cache(pages, path) -> None:
+    # Replace the cache atomically
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": CACHE_VERSION, "pages": pages}, f)
+    os.replace(tmp, path)
 
-def get_xpath(element):
+def get_results_key(crawl, page_url, links):
     """
-    Generate the XPath for a BeautifulSoup element by iterating through its parents.
+    Identify the inputs of the validation results of a page's links: the page
+    content, the links themselves, and the content and status of every link target.
+    Returns: A hash of the inputs, or None if they can't be identified (e.g. a target wasn't crawled)
     """
-    parts = []
-    child = element if element.name else element.parent
-    for parent in child.parents:
-        if parent.name is None:
-            break  # Document root reached
-        siblings = parent.find_all(child.name, recursive=False)
-        # Find the index of the child in its siblings array. XPath is 1-based.
-        index = siblings.index(child) + 1
-        parts.append(f"{child.name}[{index}]")
-        child = parent
-    parts.reverse()
-    return '/' + '/'.join(parts)
-
-def crawl_and_fetch_links(url):
-    """Wrapper function for crawl_and_fetch_links."""
+    pages = crawl["pages"]
+    targets = {}
+    for _, destination, _ in links:
+        target_url = urldefrag(destination)[0]
+        target = pages.get(target_url)
+        if target is None or target["hash"] is None:
+            return None
+        targets[target_url] = [target["hash"], target["status_code"]]
+
+    key = [pages[page_url]["hash"], sorted([d, e] for _, d, e in links), sorted(targets.items())]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+def crawl_and_fetch_links(url, page_cache=None):
+    """
+    Crawl the site (or load the crawl artifact), separating internal and external links.
+    Each distinct link is reported once, from the first page it was found on.
+    Links are identified by their element on the page; see get_link_xpath.
+    Returns: (crawl, internal_links_tuples, external_links)
+    """
+    crawl = load_crawl(args.crawl_artifact) if args.crawl_artifact else crawl_site(url, EXPORT, args.crawl_workers, args.max_depth,
+                                                                                         args.parse_workers, page_cache)
+
     visited = set()
-    internal_links_tuples = set() # (source, destination, xpath)
+    internal_links_tuples = set() # (source, destination, element)
     external_links = set()
-    def crawl(url):
-        """Recursively fetch links from the given URL, separating internal and external links."""
-        try:
-            response = requests.get(url)
-        except requests.RequestException as e:
-            print(f"Request for {url} failed: {e}")
-            global fail_build 
+    for page_url, page in crawl["pages"].items():
+        if page["error"]:
+            print(f"Request for {page_url} failed: {page['error']}")
+            global fail_build
             fail_build = True
-            return
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for a in soup.find_all('a', href=True):
-            link = urljoin(url, a.get('href'))
-            if link not in visited:
-                visited.add(link)
-                xpath = get_xpath(a)
-                if is_internal_url(link):
-                    link = convert_deployed_domain_to_base(link)
-                    internal_links_tuples.add((url, link, xpath))
-                    # print(f"Found internal link: {link} from url: {url} at xpath path: {xpath}")
-                    link_without_fragment = urlparse(link)._replace(fragment='').geturl()
-                    crawl(link_without_fragment)
-                else:
-                    external_links.add(link)
-        return internal_links_tuples, external_links
-    return crawl(url)
+
+        for link in page["links"]:
+            if link["url"] in visited:
+                continue
+            visited.add(link["url"])
+            if link["internal"]:
+                internal_links_tuples.add((page_url, link["url"], link["element"]))
+            else:
+                external_links.add(link["url"])
+    return crawl, internal_links_tuples, external_links
 
 def get_response_code(full_url) -> int:
     """Check if a URL, including its fragment, is valid. 
@@ -89,98 +151,144 @@ def get_response_code(full_url) -> int:
     url = parsed_url._replace(fragment='').geturl()
 
     try:
-        response = requests.get(url, timeout=15)
-        return response.status_code  
+        status_code, _ = fetch_page(url, EXPORT)
+        return status_code
     except requests.RequestException as e:
         print(f"Request for {url} failed: {e}")
         return -1  
 
-def check_fragment_validity(full_url) -> bool:
+def build_anchor_index(crawl) -> dict[str, set[str]]:
+    """Index the `id` and `name` anchors of every crawled page."""
+    return {page_url: set(page["anchors"]) for page_url, page in crawl["pages"].items()}
+
+def check_fragment_validity(full_url, anchor_index) -> bool:
     """Check if a fragment in a URL is valid."""
     parsed_url = urlparse(full_url)
     fragment = parsed_url.fragment 
-    response = requests.get(parsed_url._replace(fragment='').geturl())
+    page_url = parsed_url._replace(fragment='').geturl()
 
-    # If there's a fragment, check if it corresponds to an id in the HTML
-    soup = BeautifulSoup(response.text, 'html.parser')
-    if soup.find(id=fragment) or soup.find_all(attrs={"name": fragment}):
-        return True # Fragment is valid
+    if page_url not in anchor_index:
+        # Every internal link destination is crawled, so this is rare. Index it once.
+        _, text = fetch_page(page_url, EXPORT)
+        _, anchor_index[page_url], _ = extract_links(text)
 
-    # Fragment not found
-    return False 
+    # Check if the fragment corresponds to an id or name in the HTML
+    return fragment in anchor_index[page_url]
 
 def link_has_fragment(full_url) -> bool:
     return urlparse(full_url).fragment != ''
 
-def validate_internal_links(internal_links_tuples):
-    """Check if internal links are valid in parallel."""
-    invalid_links = []
+def validate_internal_links(internal_links_tuples, crawl):
+    """
+    Check if internal links are valid. Status codes recorded during the crawl are
+    reused, and any remaining destinations are fetched once each, in parallel.
+    """
+    status_codes = {page_url: page["status_code"] for page_url, page in crawl["pages"].items()}
+    unchecked = {urldefrag(destination)[0] for _, destination, _ in internal_links_tuples} - status_codes.keys()
 
-    def check_link(link):
-        """Check if the link is valid."""
-        _, destination, _ = link
-        status_code = get_response_code(destination)
-        return (link, status_code) if status_code != 200 else None
+    with ThreadPoolExecutor(max_workers=args.crawl_workers) as executor:
+        for url, status_code in zip(unchecked, executor.map(get_response_code, unchecked)):
+            status_codes[url] = status_code
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(check_link, link) for link in internal_links_tuples]
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                invalid_links.append(result)
+    invalid_links = []
+    for link in internal_links_tuples:
+        _, destination, _ = link
+        status_code = status_codes[urldefrag(destination)[0]]
+        if status_code != 200:
+            invalid_links.append((link, status_code))
 
     return invalid_links
 
-def validate_internal_link_fragments(internal_links_tuples):
-    """Check if internal link fragments are valid in parallel."""
+def validate_internal_link_fragments(internal_links_tuples, anchor_index):
+    """Check if internal link fragments are valid against the anchor index."""
     invalid_fragment_links = []
 
-    def check_fragment(link):
-        """Check if the fragment of the link is valid."""
+    for link in internal_links_tuples:
         _, destination, _ = link
-        if link_has_fragment(destination):
-            if not check_fragment_validity(destination):
-                return link
-        return None
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(check_fragment, link) for link in internal_links_tuples]
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                invalid_fragment_links.append(result)
+        if link_has_fragment(destination) and not check_fragment_validity(destination, anchor_index):
+            invalid_fragment_links.append(link)
 
     return invalid_fragment_links
 
 if __name__ == '__main__':
+    cache = load_validation_cache(args.cache) if args.cache else {}
+
     print("Collecting links...")
-    internal_links_tuples, external_links = crawl_and_fetch_links(BASE_URL)
+    with RECORDER.phase("crawl"):
+        crawl, internal_links_tuples, external_links = crawl_and_fetch_links(
+            BASE_URL, {page_url: entry["record"] for page_url, entry in cache.items()})
     print(f"Found {len(internal_links_tuples)} internal links")
     print(f"Found {len(external_links)} external links")
 
-    # Run the validation in parallel
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        validate_internal_links_future = executor.submit(validate_internal_links, internal_links_tuples)
-        validate_internal_fragments_future = executor.submit(validate_internal_link_fragments, internal_links_tuples)
+    links_by_page = {}
+    for link in internal_links_tuples:
+        links_by_page.setdefault(link[0], []).append(link)
+
+    # Reuse the results of pages whose links and link targets are unchanged
+    invalid_internal_links = []
+    invalid_fragment_links = []
+    links_to_validate = []
+    results_keys = {}
+    for page_url, links in links_by_page.items():
+        results_keys[page_url] = key = get_results_key(crawl, page_url, links)
+        cached = cache.get(page_url)
+        if key and cached and cached["results_key"] == key:
+            invalid_internal_links += [((page_url, d, e), status_code) for d, e, status_code in cached["invalid_links"]]
+            invalid_fragment_links += [(page_url, d, e) for d, e in cached["invalid_fragments"]]
+        else:
+            links_to_validate += links
+    if args.cache:
+        print(f"Reusing cached results for {len(links_by_page) - len({l[0] for l in links_to_validate})} of {len(links_by_page)} pages")
+
+    with RECORDER.phase("check"):
+        invalid_internal_links += validate_internal_links(links_to_validate, crawl)
+    with RECORDER.phase("fragment"):
+        invalid_fragment_links += validate_internal_link_fragments(links_to_validate, build_anchor_index(crawl))
+
+    if args.cache:
+        new_cache = {page_url: {"record": page, "results_key": results_keys.get(page_url),
+                                "invalid_links": [], "invalid_fragments": []}
+                     for page_url, page in crawl["pages"].items()}
+        for (source, destination, element), status_code in invalid_internal_links:
+            new_cache[source]["invalid_links"].append([destination, element, status_code])
+        for source, destination, element in invalid_fragment_links:
+            new_cache[source]["invalid_fragments"].append([destination, element])
+        save_validation_cache(new_cache, args.cache)
 
-        # Wait for both validations to complete
-        invalid_internal_links = validate_internal_links_future.result()
-        invalid_fragment_links = validate_internal_fragments_future.result()
+    print_connection_stats()
+    if args.report or args.junit:
+        for (source, destination, element), status_code in invalid_internal_links:
+            RECORDER.add_broken_link(url=destination, page=source, xpath=get_link_xpath(crawl["pages"][source], element),
+                                     status_code=status_code, reason=f"Status code: {status_code}")
+        for source, destination, element in invalid_fragment_links:
+            RECORDER.add_broken_link(url=destination, page=source, xpath=get_link_xpath(crawl["pages"][source], element),
+                                     reason=f"Fragment #{urlparse(destination).fragment} not found in the HTML")
+        report = build_report("internal", BASE_URL)
+        if args.report:
+            write_json_report(report, args.report)
+        if args.junit:
+            write_junit_report(report, args.junit)
 
     # Print the results
     if len(invalid_internal_links) == 0 and len(invalid_fragment_links) == 0 and not fail_build:
         print(f"All {len(internal_links_tuples)} internal links are valid.")
         sys.exit(0) # Exit with success
 
+    def describe_link(link):
+        # XPaths are only computed for the links that are reported
+        source, destination, element = link
+        xpath = get_link_xpath(crawl["pages"][source], element)
+        return f"On page: {source} \nto: {destination} \nwith XPath: {xpath}"
+
     print("ERROR with the following internal links:")
     for item in invalid_internal_links:
         link = item[0]
         status_code = item[1]
-        print(f"On page: {link[0]} \nto: {link[1]} \nwith XPath: {link[2]}")
+        print(describe_link(link))
         print(f"Status code: {status_code} \n")
     
     for link in invalid_fragment_links:
-        print(f"On page: {link[0]} \nto: {link[1]} \nwith XPath: {link[2]}")
+        print(describe_link(link))
         print(f"Fragment #{urlparse(link[1]).fragment} not found in the HTML. \n")
     
     print('Hint: Use $x("XPath") in the browser console to find the element.')